@@ -1 +1,3 @@
 from .arg_parser import ArgParser
+from .server_arg_parser import ServerArgParser
+from .benchmark_arg_parser import BenchmarkArgParser
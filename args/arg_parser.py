@@ -14,14 +14,144 @@ class ArgParser(object):
         parser.add_argument('--reports_path',
                             required=True,
                             help='Path to file with radiology reports.')
+        self.add_impression_arguments(parser)
+        parser.add_argument('--extension',
+                            default='txt',
+                            help='Extension of the report files in a ' +
+                                 'folder without CSVs, each holding one ' +
+                                 'report keyed by its file name.')
+
+        self.add_pipeline_arguments(parser)
+
+        # Output parameters.
+        parser.add_argument('--output_path',
+                            default='labeled_reports.csv',
+                            help='Output path to write labels to.')
+        parser.add_argument('--output_format',
+                            choices=['csv', 'parquet', 'arrow'],
+                            default='csv',
+                            help='Format of the output. Parquet and Arrow ' +
+                                 'IPC outputs, which need pyarrow, store ' +
+                                 'the input row of each report and int8 ' +
+                                 'labels, null when unmentioned, with one ' +
+                                 'row group per chunk.')
+        parser.add_argument('--omit_reports',
+                            action='store_true',
+                            help='Leave the report text out of the output.')
+
+        # Performance.
+        parser.add_argument('--chunk_size',
+                            type=int,
+                            default=None,
+                            help='Number of reports loaded and labeled at ' +
+                                 'a time; labels are appended to the ' +
+                                 'output as each chunk finishes.')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of worker processes, each with ' +
+                                 'its own parser, used to label reports. ' +
+                                 'For a folder, each worker labels whole ' +
+                                 'CSVs.')
+        parser.add_argument('--io_workers',
+                            type=int,
+                            default=8,
+                            help='Number of threads reading the report ' +
+                                 'files of a folder.')
+
+        # Checkpointing.
+        parser.add_argument('--resume',
+                            action='store_true',
+                            help='When labeling a folder of CSVs, skip ' +
+                                 'files already labeled and continue ' +
+                                 'partially labeled ones.')
+        parser.add_argument('--claim_shards',
+                            action='store_true',
+                            help='Claim each CSV of a folder through a ' +
+                                 'lock file, so several runs can share ' +
+                                 'the folder. Implies --resume.')
+        parser.add_argument('--lock_timeout',
+                            type=float,
+                            default=None,
+                            help='Seconds without a heartbeat after ' +
+                                 'which the lock of a claimed CSV is ' +
+                                 'taken over. Locks are refreshed a few ' +
+                                 'times per timeout while held.')
+
+        # Profiling.
+        parser.add_argument('--trace_path',
+                            default=None,
+                            help='Path to write a JSON lines trace of the ' +
+                                 'time spent in each step of every ' +
+                                 'report. Worker processes write their ' +
+                                 'own trace next to it.')
+        parser.add_argument('--slowest',
+                            type=int,
+                            default=10,
+                            help='Number of slowest reports listed in the ' +
+                                 'trace summary.')
+        parser.add_argument('--rule_stats_path',
+                            default=None,
+                            help='Path to write a CSV ranking every ' +
+                                 'negation and uncertainty rule by its ' +
+                                 'matching time, with how often it was ' +
+                                 'evaluated and fired. Worker processes ' +
+                                 'write their own CSV next to it.')
+        parser.add_argument('--profile',
+                            choices=['cprofile', 'pyinstrument'],
+                            default=None,
+                            help='Profile the main process with this ' +
+                                 'profiler.')
+        parser.add_argument('--profile_path',
+                            default='profile.out',
+                            help='Output path of the profile.')
+
+        self.parser = parser
+
+    def add_impression_arguments(self, parser):
+        """Add the arguments extracting the impression of each report."""
         parser.add_argument('--extract_impression',
                             action='store_true',
                             help='Extract the impression section of the ' +
                                  'report.')
-        parser.add_argument('--extension',
-                            default='txt',
-                            help='Extension for reports stored in a folder.')
+        parser.add_argument('--impression_rules',
+                            choices=['negbio', 'mimic'],
+                            default='negbio',
+                            help='Rules finding the impression: NegBio\'s ' +
+                                 'section splitter, or the MIMIC-CXR ' +
+                                 'section parser of etc/, which falls ' +
+                                 'back to the findings, last paragraph or ' +
+                                 'comparison section of the raw report.')
+        parser.add_argument('--missing_impression',
+                            choices=['skip', 'full', 'error'],
+                            default='skip',
+                            help='For a report without an impression, ' +
+                                 'leave its labels empty, label the full ' +
+                                 'report, or stop with an error.')
+
+    def add_pipeline_arguments(self, parser):
+        """Add the arguments configuring the labeling stages."""
+        self.add_stage_arguments(parser)
+
+        # Caches.
+        parser.add_argument('--parse_cache_dir',
+                            default=None,
+                            help='Directory of a persistent cache of ' +
+                                 'sentence parses, reused across runs.')
+        parser.add_argument('--sentence_cache_size',
+                            type=int,
+                            default=0,
+                            help='Number of classified sentences to ' +
+                                 'remember, so repeated sentences skip ' +
+                                 'parsing and detection.')
 
+        # Misc.
+        parser.add_argument('-v', '--verbose',
+                            action='store_true',
+                            help='Print progress to stdout.')
+
+    def add_stage_arguments(self, parser):
+        """Add the phrase and rule arguments of the labeling stages."""
         # Phrases
         parser.add_argument('--mention_phrases_dir',
                             default='phrases/mention',
@@ -43,25 +173,35 @@ class ArgParser(object):
                             default='patterns/post_negation_uncertainty.txt',
                             help='Path to post-negation uncertainty rules.')
 
-        # Output parameters.
-        parser.add_argument('--output_path',
-                            default='labeled_reports.csv',
-                            help='Output path to write labels to.')
-
-        # Misc.
-        parser.add_argument('-v', '--verbose',
-                            action='store_true',
-                            help='Print progress to stdout.')
+    def convert_pipeline_args(self, args):
+        """Convert the paths configuring the labeling stages."""
+        self.convert_stage_args(args)
+        if args.parse_cache_dir is not None:
+            args.parse_cache_dir = Path(args.parse_cache_dir)
 
-        self.parser = parser
+    def convert_stage_args(self, args):
+        """Convert the phrase paths of the labeling stages."""
+        args.mention_phrases_dir = Path(args.mention_phrases_dir)
+        args.unmention_phrases_dir = Path(args.unmention_phrases_dir)
 
     def parse_args(self):
         """Parse and validate the supplied arguments."""
         args = self.parser.parse_args()
 
         args.reports_path = Path(args.reports_path)
-        args.mention_phrases_dir = Path(args.mention_phrases_dir)
-        args.unmention_phrases_dir = Path(args.unmention_phrases_dir)
         args.output_path = Path(args.output_path)
+        self.convert_pipeline_args(args)
+        if args.trace_path is not None:
+            args.trace_path = Path(args.trace_path)
+        if args.rule_stats_path is not None:
+            args.rule_stats_path = Path(args.rule_stats_path)
+        args.profile_path = Path(args.profile_path)
+
+        if args.io_workers < 1:
+            self.parser.error('--io_workers must be at least 1.')
+        if args.workers < 1:
+            self.parser.error('--workers must be at least 1.')
+        if args.chunk_size is not None and args.chunk_size < 1:
+            self.parser.error('--chunk_size must be at least 1.')
 
         return args
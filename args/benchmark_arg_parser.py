@@ -0,0 +1,81 @@
+"""Define benchmark argument parser class."""
+import argparse
+from pathlib import Path
+
+from .arg_parser import ArgParser
+
+
+class BenchmarkArgParser(ArgParser):
+    """Argument parser for benchmarks/run.py"""
+
+    def __init__(self):
+        """Initialize argument parser."""
+        parser = argparse.ArgumentParser()
+
+        # Corpus parameters.
+        parser.add_argument('--reports_path',
+                            default=None,
+                            help='CSV of real reports to sample the ' +
+                                 'corpus from, instead of generating it.')
+        parser.add_argument('--n_reports',
+                            type=int,
+                            default=1000,
+                            help='Number of reports in the corpus.')
+        parser.add_argument('--sentences_per_report',
+                            type=float,
+                            default=3,
+                            help='Mean number of sentences of a ' +
+                                 'generated report.')
+        parser.add_argument('--padding_words',
+                            type=float,
+                            default=4,
+                            help='Mean number of words padding a ' +
+                                 'generated sentence; the padding is ' +
+                                 'exponentially distributed, so some ' +
+                                 'sentences are long.')
+        parser.add_argument('--seed',
+                            type=int,
+                            default=0,
+                            help='Random seed of the corpus.')
+
+        self.add_stage_arguments(parser)
+
+        # Measurement parameters.
+        parser.add_argument('--trace_memory',
+                            action='store_true',
+                            help='Measure the peak memory allocated by ' +
+                                 'each stage, at the cost of speed.')
+        parser.add_argument('--output_path',
+                            default=None,
+                            help='Path to write the JSON results to, ' +
+                                 'instead of stdout.')
+        parser.add_argument('--baseline_path',
+                            default=None,
+                            help='JSON results of an earlier run to ' +
+                                 'compare the throughput of each stage to.')
+        parser.add_argument('--max_slowdown',
+                            type=float,
+                            default=1.2,
+                            help='Exit with an error if a stage is this ' +
+                                 'many times slower than the baseline.')
+
+        self.parser = parser
+
+    def parse_args(self):
+        """Parse and validate the supplied arguments."""
+        args = self.parser.parse_args()
+
+        self.convert_stage_args(args)
+        if args.reports_path is not None:
+            args.reports_path = Path(args.reports_path)
+        if args.output_path is not None:
+            args.output_path = Path(args.output_path)
+        if args.baseline_path is not None:
+            args.baseline_path = Path(args.baseline_path)
+
+        if args.n_reports < 1:
+            self.parser.error('--n_reports must be at least 1.')
+        if args.sentences_per_report < 1:
+            self.parser.error('--sentences_per_report must be at least 1.')
+
+        return args
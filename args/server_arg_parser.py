@@ -0,0 +1,56 @@
+"""Define server argument parser class."""
+import argparse
+from pathlib import Path
+
+from .arg_parser import ArgParser
+
+
+class ServerArgParser(ArgParser):
+    """Argument parser for serve.py"""
+
+    def __init__(self):
+        """Initialize argument parser."""
+        parser = argparse.ArgumentParser()
+
+        # Report parameters.
+        self.add_impression_arguments(parser)
+
+        self.add_pipeline_arguments(parser)
+
+        # Server parameters.
+        parser.add_argument('--host',
+                            default='127.0.0.1',
+                            help='Host to listen on.')
+        parser.add_argument('--port',
+                            type=int,
+                            default=8080,
+                            help='Port to listen on.')
+        parser.add_argument('--socket_path',
+                            default=None,
+                            help='Listen on this Unix socket instead of ' +
+                                 'a TCP port.')
+        parser.add_argument('--batch_window',
+                            type=float,
+                            default=10,
+                            help='Milliseconds to wait for concurrent ' +
+                                 'requests to label together.')
+        parser.add_argument('--max_batch_size',
+                            type=int,
+                            default=64,
+                            help='Maximum number of reports labeled ' +
+                                 'together.')
+
+        self.parser = parser
+
+    def parse_args(self):
+        """Parse and validate the supplied arguments."""
+        args = self.parser.parse_args()
+
+        self.convert_pipeline_args(args)
+        if args.socket_path is not None:
+            args.socket_path = Path(args.socket_path)
+
+        if args.max_batch_size < 1:
+            self.parser.error('--max_batch_size must be at least 1.')
+
+        return args
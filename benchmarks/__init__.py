@@ -0,0 +1 @@
+from .corpus import generate_reports, sample_reports
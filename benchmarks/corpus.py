@@ -0,0 +1,87 @@
+"""Build report corpora for benchmarking."""
+import random
+
+import pandas as pd
+
+# Sentences built around a mention phrase, covering positive, negated and
+# uncertain phrasings.
+MENTION_TEMPLATES = [
+    "there is {}.",
+    "no {}.",
+    "no evidence of {}.",
+    "possible {}.",
+    "{} is unchanged.",
+    "mild {} is again seen.",
+    "cannot exclude {}.",
+    "interval resolution of {}.",
+    "new {} in the right lower lobe.",
+    "findings may reflect {} in the appropriate clinical setting.",
+]
+
+# Sentences without mentions, as found in most impressions.
+FILLER_SENTENCES = [
+    "no acute cardiopulmonary process.",
+    "the lungs are clear.",
+    "comparison is made to the prior study.",
+    "recommend follow-up radiograph in six weeks.",
+    "findings were discussed with the referring physician by telephone.",
+]
+
+# Words used to pad sentences to a longer length.
+PADDING_WORDS = ("when compared to the prior radiograph obtained at the "
+                 "outside hospital on the left and right side with "
+                 "patient positioning and technique").split()
+
+
+def load_mention_phrases(mention_phrases_dir):
+    """Read every mention phrase, as the Extractor does."""
+    phrases = []
+    for phrases_path in sorted(mention_phrases_dir.glob("*.txt")):
+        with phrases_path.open() as f:
+            for line in f:
+                phrase = line.strip().replace("_", " ")
+                if phrase:
+                    phrases.append(phrase)
+    return phrases
+
+
+def generate_reports(n_reports, mention_phrases, sentences_per_report=3,
+                     padding_words=4, seed=0):
+    """Generate synthetic reports.
+
+    The number of sentences of a report is geometrically distributed with
+    the given mean, and each sentence is padded with an exponentially
+    distributed number of words, so a few sentences are very long.
+    """
+    rng = random.Random(seed)
+    reports = []
+    for _ in range(n_reports):
+        n_sentences = 1
+        while rng.random() < (sentences_per_report - 1) / sentences_per_report:
+            n_sentences += 1
+
+        sentences = []
+        for _ in range(n_sentences):
+            if rng.random() < 0.7:
+                template = rng.choice(MENTION_TEMPLATES)
+                sentence = template.format(rng.choice(mention_phrases))
+            else:
+                sentence = rng.choice(FILLER_SENTENCES)
+            n_padding = int(rng.expovariate(1 / padding_words)) \
+                if padding_words > 0 else 0
+            if n_padding:
+                padding = " ".join(rng.choice(PADDING_WORDS)
+                                   for _ in range(n_padding))
+                sentence = sentence[:-1] + " " + padding + "."
+            sentences.append(sentence.capitalize())
+        reports.append(" ".join(sentences))
+
+    return reports
+
+
+def sample_reports(reports_path, n_reports, seed=0):
+    """Sample reports with replacement from a one or two column CSV."""
+    reports = pd.read_csv(reports_path, header=None).iloc[:, -1]
+    reports = [x for x in reports.tolist() if type(x) is str]
+    rng = random.Random(seed)
+    return [rng.choice(reports) for _ in range(n_reports)]
@@ -0,0 +1,194 @@
+"""Benchmark each stage of the labeling pipeline.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.run --n_reports 1000 --output_path bench.json
+"""
+import json
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import bioc
+import numpy as np
+from negbio.pipeline import negdetect
+
+from args import BenchmarkArgParser
+from loader import Loader
+from stages import Extractor, Classifier, Aggregator
+from constants import *
+from .corpus import load_mention_phrases, generate_reports, sample_reports
+
+# Stages in pipeline order; parse, convert and detect make up classify.
+STAGES = ["load", "extract", "parse", "convert", "detect", "aggregate"]
+
+
+def single(document):
+    """Wrap a document in a collection of its own."""
+    collection = bioc.BioCCollection()
+    collection.add_document(document)
+    return collection
+
+
+def time_stage(function, items, trace_memory=False):
+    """Apply function to each item, timing every call.
+
+    Return:
+        (list, list, int): results, seconds per item, and the peak bytes
+        allocated during the stage (None unless tracing memory)
+    """
+    if trace_memory:
+        tracemalloc.start()
+    results = []
+    seconds = []
+    for item in items:
+        start = time.perf_counter()
+        results.append(function(item))
+        seconds.append(time.perf_counter() - start)
+
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results, seconds, peak
+
+
+def summarize(seconds, peak=None):
+    """Summarize the per-report times of a stage."""
+    seconds = np.array(seconds)
+    summary = {"total_seconds": float(seconds.sum()),
+               "reports_per_second": float(len(seconds) / seconds.sum())
+               if seconds.sum() > 0 else None,
+               "p50_ms": float(np.percentile(seconds, 50) * 1000),
+               "p99_ms": float(np.percentile(seconds, 99) * 1000)}
+    if peak is not None:
+        summary["peak_traced_mb"] = peak / 2**20
+    return summary
+
+
+def run(args, reports):
+    """Time every stage over the reports, one report at a time."""
+    loader = Loader(None)
+    extractor = Extractor(args.mention_phrases_dir,
+                          args.unmention_phrases_dir)
+    classifier = Classifier(args.pre_negation_uncertainty_path,
+                            args.negation_path,
+                            args.post_negation_uncertainty_path)
+    aggregator = Aggregator(CATEGORIES)
+
+    def load(indexed_report):
+        i, report = indexed_report
+        loader.load_reports([report])
+        loader.start = i
+        loader.prep_collection()
+        return loader.collection.documents[0]
+
+    def extract(document):
+        extractor.extract(single(document))
+        return document
+
+    def parse(document):
+        # As in the Classifier, sentences without mentions are not parsed.
+        document.passages[0].sentences = classifier.mentioned_sentences(
+            document, classifier.mention_locs(document))
+        classifier.parser.parse_doc(document)
+        return document
+
+    def convert(document):
+        classifier.ptb2dep.convert_doc(document)
+        return document
+
+    def detect(document):
+        negdetect.detect(document, classifier.detector)
+        return document
+
+    def aggregate(document):
+        return aggregator.aggregate(single(document))
+
+    functions = {"load": load, "extract": extract, "parse": parse,
+                 "convert": convert, "detect": detect,
+                 "aggregate": aggregate}
+    items = list(enumerate(reports))
+    stage_seconds = {}
+    results = {}
+    for stage in STAGES:
+        items, seconds, peak = time_stage(functions[stage], items,
+                                          args.trace_memory)
+        stage_seconds[stage] = seconds
+        results[stage] = summarize(seconds, peak)
+
+    classify_seconds = np.sum([stage_seconds[stage]
+                               for stage in ("parse", "convert", "detect")],
+                              axis=0)
+    results["classify"] = summarize(classify_seconds)
+    report_seconds = np.sum([stage_seconds[stage] for stage in STAGES],
+                            axis=0)
+    results["total"] = summarize(report_seconds)
+
+    return results
+
+
+def compare(results, baseline, max_slowdown):
+    """Return the stages slower than the baseline by over max_slowdown."""
+    regressions = {}
+    for stage, summary in results.items():
+        if stage not in baseline:
+            continue
+        before = baseline[stage]["reports_per_second"]
+        after = summary["reports_per_second"]
+        if before and after and before / after > max_slowdown:
+            regressions[stage] = before / after
+    return regressions
+
+
+def main():
+    parser = BenchmarkArgParser()
+    args = parser.parse_args()
+
+    if args.reports_path is None:
+        phrases = load_mention_phrases(args.mention_phrases_dir)
+        reports = generate_reports(args.n_reports, phrases,
+                                   args.sentences_per_report,
+                                   args.padding_words, args.seed)
+    else:
+        reports = sample_reports(args.reports_path, args.n_reports,
+                                 args.seed)
+
+    stages = run(args, reports)
+    output = {
+        "config": {"n_reports": args.n_reports,
+                   "reports_path": str(args.reports_path),
+                   "sentences_per_report": args.sentences_per_report,
+                   "padding_words": args.padding_words,
+                   "seed": args.seed,
+                   "mention_phrases_dir": str(args.mention_phrases_dir),
+                   "negation_path": args.negation_path,
+                   "python": platform.python_version()},
+        "stages": stages,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    regressions = {}
+    if args.baseline_path is not None:
+        with args.baseline_path.open() as f:
+            baseline = json.load(f)
+        regressions = compare(stages, baseline["stages"], args.max_slowdown)
+        output["regressions"] = regressions
+
+    if args.output_path is None:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        with args.output_path.open("w") as f:
+            json.dump(output, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
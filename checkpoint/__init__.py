@@ -0,0 +1,2 @@
+from .manifest import Manifest
+from .lock import ShardLock, LockLostError
@@ -0,0 +1,172 @@
+"""Define shard lock class."""
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# Heartbeats per stale_after period, so a live lock is never stale.
+HEARTBEATS_PER_TIMEOUT = 4
+# Seconds to wait for a lock another process briefly moved aside.
+RESTORE_WAIT = 0.1
+
+
+class LockLostError(Exception):
+    """Raised when another process has taken over a held shard lock."""
+
+
+class ShardLock(object):
+    """Claim on a shard through a lock file on shared storage.
+
+    Lets several independent invocations, e.g. one per node, label the
+    same folder without labeling a shard twice. The lock file holds a
+    token unique to its holder and is created atomically, by linking a
+    complete file into place. While held, a heartbeat thread refreshes
+    it; a lock not refreshed for `stale_after` seconds is assumed to
+    belong to a dead process and may be taken over. The holder checks
+    its token before every refresh and on release, so it never touches
+    a lock taken over from it.
+    """
+
+    def __init__(self, lock_path, stale_after=None):
+        self.lock_path = Path(lock_path)
+        self.stale_after = stale_after
+        self.token = (f"{socket.gethostname()} {os.getpid()} "
+                      f"{uuid.uuid4().hex}")
+        self.lost = False
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    def unique_path(self, kind):
+        return self.lock_path.with_name(
+            f"{self.lock_path.name}.{kind}.{uuid.uuid4().hex}")
+
+    def create(self):
+        """Create the lock file, returning False if it already exists."""
+        tmp_path = self.unique_path("tmp")
+        with tmp_path.open("w") as f:
+            f.write(f"{self.token}\n")
+        try:
+            # Unlike O_EXCL, linking is atomic on NFS too, and the lock
+            # appears with its token already written.
+            os.link(str(tmp_path), str(self.lock_path))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(str(tmp_path))
+
+    def read(self, path=None):
+        """Return the token of the lock file, or None if there is none."""
+        try:
+            with open(str(path or self.lock_path)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def held(self):
+        """Return whether this process holds the lock."""
+        token = self.read()
+        if token is None:
+            # The lock may be moved aside for a moment by remove.
+            time.sleep(RESTORE_WAIT)
+            token = self.read()
+        return token == self.token
+
+    def is_stale(self):
+        if self.stale_after is None:
+            return False
+        try:
+            age = time.time() - self.lock_path.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        return age > self.stale_after
+
+    def remove(self, token):
+        """Remove the lock file if it holds token.
+
+        The lock is moved aside before its token is checked, so a lock
+        created meanwhile by another process is put back, not removed.
+
+        Return:
+            True if the lock with token was removed.
+        """
+        moved_path = self.unique_path("moved")
+        try:
+            os.rename(str(self.lock_path), str(moved_path))
+        except FileNotFoundError:
+            return False
+        if self.read(moved_path) == token:
+            os.remove(str(moved_path))
+            return True
+
+        # Not the expected lock: restore it unless yet another exists.
+        try:
+            os.link(str(moved_path), str(self.lock_path))
+        except FileExistsError:
+            pass
+        os.remove(str(moved_path))
+        return False
+
+    def acquire(self):
+        """Claim the shard, starting the heartbeat of the lock.
+
+        Return:
+            True if this process now holds the lock.
+        """
+        if not self.create():
+            stale_token = self.read()
+            if stale_token is None or not self.is_stale():
+                return False
+            # Only the process moving aside the very lock it judged stale
+            # goes on to create its own.
+            if not self.remove(stale_token) or not self.create():
+                return False
+
+        # Re-read the token, in case the new lock was moved aside.
+        if not self.held():
+            return False
+        if self.stale_after is not None:
+            self.heartbeat = threading.Thread(
+                target=self.beat,
+                args=(self.stale_after / HEARTBEATS_PER_TIMEOUT,),
+                daemon=True)
+            self.heartbeat.start()
+        return True
+
+    def beat(self, interval):
+        """Refresh the lock every interval seconds until released."""
+        while not self.stopped.wait(interval):
+            if not self.refresh():
+                return
+
+    def refresh(self):
+        """Mark the lock as held by a live process.
+
+        Return:
+            False, and mark the lock as lost, if another process holds it.
+        """
+        if not self.held():
+            self.lost = True
+            return False
+        try:
+            os.utime(str(self.lock_path))
+        except FileNotFoundError:
+            # Moved aside for a moment; the next refresh checks again.
+            pass
+        return True
+
+    def check(self):
+        """Raise LockLostError if the lock was taken over."""
+        if self.lost or not self.held():
+            self.lost = True
+            raise LockLostError(f"Lock {self.lock_path} was taken over.")
+
+    def release(self):
+        """Stop the heartbeat and remove the lock if still held."""
+        self.stopped.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+        if not self.lost:
+            self.remove(self.token)
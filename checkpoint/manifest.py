@@ -0,0 +1,161 @@
+"""Define checkpoint manifest classes."""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Status of a shard in the manifest.
+PARTIAL = "partial"
+COMPLETE = "complete"
+FAILED = "failed"
+
+# Bytes read at a time when hashing files.
+BLOCK_SIZE = 1 << 20
+
+
+def hash_file(path, size=None):
+    """Hash the first size bytes of a file, or the whole file."""
+    hasher = hashlib.sha256()
+    remaining = float("inf") if size is None else size
+    with open(path, "rb") as fp:
+        while remaining > 0:
+            block = fp.read(int(min(BLOCK_SIZE, remaining)))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+
+    return hasher
+
+
+class Manifest(object):
+    """Checkpoint manifest of the input shards labeled from a folder.
+
+    Each shard has its own JSON record in the checkpoint directory, so
+    records are small and can be replaced atomically.
+    """
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    def record_path(self, shard):
+        return self.checkpoint_dir / f"{shard}.json"
+
+    def lock_path(self, shard):
+        return self.checkpoint_dir / f"{shard}.lock"
+
+    def load(self, shard):
+        """Return the record of a shard, or None if there is none."""
+        try:
+            with self.record_path(shard).open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, shard, record):
+        """Replace the record of a shard."""
+        record_path = self.record_path(shard)
+        tmp_path = record_path.with_name(record_path.name + ".tmp")
+        with tmp_path.open("w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(str(tmp_path), str(record_path))
+
+    def checkpoint(self, shard, input_path, output_path, resume=False):
+        """Start tracking a shard, picking up its earlier progress when
+        resuming."""
+        return ShardCheckpoint(self, shard, input_path, output_path, resume)
+
+
+class ShardCheckpoint(object):
+    """Progress of one shard, saved to the manifest after each write.
+
+    The record keeps the number of input rows labeled, the size and hash
+    of the output written for them, and the hash of the input shard. A
+    resumed shard continues after the rows of a record whose input is
+    unchanged and whose output still matches; rows written after the
+    last saved record are truncated away.
+    """
+
+    def __init__(self, manifest, shard, input_path, output_path, resume):
+        self.manifest = manifest
+        self.shard = shard
+        self.output_path = Path(output_path)
+        self.hasher = hashlib.sha256()
+        self.record = {"shard": shard,
+                       "input": str(input_path),
+                       "input_hash": hash_file(input_path).hexdigest(),
+                       "output": str(output_path),
+                       "status": PARTIAL,
+                       "rows": 0,
+                       "output_size": 0,
+                       "output_hash": self.hasher.hexdigest()}
+
+        previous = manifest.load(shard)
+        if resume and previous is not None:
+            self.restore(previous)
+
+    @property
+    def rows(self):
+        """Number of input rows already labeled."""
+        return self.record["rows"]
+
+    @property
+    def complete(self):
+        return self.record["status"] == COMPLETE
+
+    def restore(self, previous):
+        """Continue from a previous record if its output still matches."""
+        if (previous.get("input_hash") != self.record["input_hash"] or
+                previous.get("output") != self.record["output"] or
+                not self.output_path.exists()):
+            return
+        output_size = previous["output_size"]
+        if self.output_path.stat().st_size < output_size:
+            return
+        hasher = hash_file(self.output_path, output_size)
+        if hasher.hexdigest() != previous["output_hash"]:
+            return
+
+        if self.output_path.stat().st_size > output_size:
+            with self.output_path.open("r+b") as fp:
+                fp.truncate(output_size)
+        self.hasher = hasher
+        for key in ("status", "rows", "output_size", "output_hash"):
+            self.record[key] = previous[key]
+
+    def restart(self):
+        """Forget earlier progress, to label the shard from its start."""
+        self.hasher = hashlib.sha256()
+        self.record.update(status=PARTIAL, rows=0, output_size=0,
+                           output_hash=self.hasher.hexdigest())
+
+    def update(self, rows):
+        """Record the rows labeled so far, hashing the output written
+        since the last update."""
+        if rows == 0 or self.record["rows"] == 0:
+            # The output was (re)written from its start.
+            self.hasher = hashlib.sha256()
+            self.record["output_size"] = 0
+        with self.output_path.open("rb") as fp:
+            fp.seek(self.record["output_size"])
+            for block in iter(lambda: fp.read(BLOCK_SIZE), b""):
+                self.hasher.update(block)
+                self.record["output_size"] += len(block)
+
+        self.record["rows"] = rows
+        self.record["output_hash"] = self.hasher.hexdigest()
+        self.record["status"] = PARTIAL
+        self.record.pop("error", None)
+        self.manifest.save(self.shard, self.record)
+
+    def finish(self):
+        """Mark the shard as completely labeled."""
+        self.record["status"] = COMPLETE
+        self.manifest.save(self.shard, self.record)
+
+    def fail(self, error):
+        """Mark the shard as failed, keeping the rows labeled before."""
+        self.record["status"] = FAILED
+        self.record["error"] = repr(error)
+        self.manifest.save(self.shard, self.record)
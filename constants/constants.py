@@ -24,3 +24,6 @@ UNCERTAIN = -1
 UNCERTAINTY = "uncertainty"
 NEGATION = "negation"
 REPORTS = "Reports"
+REPORT_INDEX = "Report Index"
+REPORT_ID = "Report ID"
+CHECKPOINT_DIR = ".checkpoint"
@@ -3,6 +3,7 @@ import sys
 import os
 import argparse
 import csv
+import multiprocessing
 from pathlib import Path
 
 from tqdm import tqdm
@@ -20,11 +21,92 @@ parser.add_argument('--reports_path',
 parser.add_argument('--output_path',
                     required=True,
                     help='Path to output CSV files.')
-
-
-def list_rindex(l, s):
-    """Helper function: *last* matching element in a list"""
-    return len(l) - l[-1::-1].index(s) - 1
+parser.add_argument('--workers',
+                    type=int,
+                    default=os.cpu_count(),
+                    help='Number of processes sectioning reports.')
+parser.add_argument('--shard_size',
+                    type=int,
+                    default=10000,
+                    help='Number of reports written to each CSV file.')
+
+
+def sorted_entries(path, prefix, is_dir=True):
+    """List the names of a folder's entries with a prefix, in sorted
+    order."""
+    with os.scandir(path) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.name.startswith(prefix) and
+                      entry.is_dir() == is_dir)
+
+
+def list_studies(reports_path):
+    """List the report of every study, in patient then study order."""
+    studies = []
+    # get all higher up folders (p00, p01, etc)
+    p_grp_folders = [p for p in sorted_entries(reports_path, 'p')
+                     if len(p) == 3]
+    for p_grp in p_grp_folders:
+        # the folders in MIMIC-CXR
+        cxr_path = reports_path / p_grp
+        # For each patient in this grouping folder
+        for p in sorted_entries(cxr_path, 'p'):
+            patient_path = cxr_path / p
+            studies.extend(patient_path / s
+                           for s in sorted_entries(patient_path, 's',
+                                                   is_dir=False)
+                           if s.endswith('.txt'))
+    return studies
+
+
+def section_study(study_path):
+    """Extract the impression, or the best section standing in for it,
+    of one study.
+
+    Return:
+        (list, bool): the [study, text] row, and whether a section was
+        found
+    """
+    with open(study_path, 'r') as fp:
+        text = fp.read()
+
+    # get study string name without the txt extension
+    s_stem = study_path.name[0:-4]
+
+    impression = sp.extract_impression(text, s_stem)
+    if impression is None:
+        # we didn't find anything :(
+        return [s_stem, ''], False
+
+    # store the text of this section
+    return [s_stem, impression], True
+
+
+class ShardWriter(object):
+    """Write rows to numbered CSV files of at most shard_size rows each,
+    as they come."""
+
+    def __init__(self, output_path, shard_size):
+        self.output_path = output_path
+        self.shard_size = shard_size
+        self.n_rows = 0
+        self.fp = None
+        self.csvwriter = None
+
+    def writerow(self, row):
+        if self.n_rows % self.shard_size == 0:
+            self.close()
+            n_fn = self.n_rows // self.shard_size
+            self.fp = open(self.output_path / f'mimic_cxr_{n_fn:03d}.csv',
+                           'w')
+            self.csvwriter = csv.writer(self.fp)
+        self.csvwriter.writerow(row)
+        self.n_rows += 1
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
 
 
 def main(args):
@@ -36,95 +118,31 @@ def main(args):
     if not output_path.exists():
         output_path.mkdir()
 
-    # not all reports can be automatically sectioned
-    # we load in some dictionaries which have manually determined sections
-    custom_section_names, custom_indices = sp.custom_mimic_cxr_rules()
+    studies = list_studies(reports_path)
 
-    # get all higher up folders (p00, p01, etc)
-    p_grp_folders = os.listdir(reports_path)
-    p_grp_folders = [p for p in p_grp_folders
-                     if p.startswith('p') and len(p) == 3]
-    p_grp_folders.sort()
-
-    patient_studies = []
-    for p_grp in p_grp_folders:
-        # the folders in MIMIC-CXR
-        cxr_path = reports_path / p_grp
-        p_folders = os.listdir(cxr_path)
-        p_folders = [p for p in p_folders if p.startswith('p')]
-        p_folders.sort()
-
-        # For each patient in this grouping folder
-        for p in tqdm(p_folders):
-            patient_path = cxr_path / p
-            studies = os.listdir(patient_path)
-            studies = [s for s in studies
-                       if s.endswith('.txt') and s.startswith('s')]
-
-            for s in studies:
-                with open(patient_path / s, 'r') as fp:
-                    text = ''.join(fp.readlines())
-
-                # get study string name without the txt extension
-                s_stem = s[0:-4]
-
-                # custom rules for some poorly formatted reports
-                if s_stem in custom_indices:
-                    idx = custom_indices[s_stem]
-                    patient_studies.append([s_stem, text[idx[0]:idx[1]]])
-                    continue
-
-                # split text into sections
-                sections, section_names, section_idx = sp.section_text(
-                    text
-                )
-
-                # check to see if this has mis-named sections
-                # e.g. sometimes the impression is in the comparison section
-                if s_stem in custom_section_names:
-                    sn = custom_section_names[s_stem]
-                    idx = list_rindex(section_names, sn)
-                    patient_studies.append([s_stem, sections[idx].strip()])
-                    continue
-
-                # grab the *last* section with the given title
-                # prioritize impression > findings > last paragraph > comparison
-
-                # note comparison seems unusual but if no other sections
-                # exist the radiologist has usually written the
-                # report in the comparison section
-                idx = -1
-                for sn in ('impression', 'findings', 'last_paragraph', 'comparison'):
-                    if sn in section_names:
-                        idx = list_rindex(section_names, sn)
-                        break
-
-                if idx == -1:
-                    # we didn't find anything :(
-                    patient_studies.append([s_stem, ''])
-                    print(f'no impression/findings: {patient_path / s}')
-                else:
-                    # store the text of this section
-                    patient_studies.append([s_stem, sections[idx].strip()])
-
-            # if len(patient_studies) > 0:
-            #     with open(output_path / f'{p}.csv', 'w') as fp:
-            #         csvwriter = csv.writer(fp)
-            #         for row in patient_studies:
-            #             csvwriter.writerow(row)
+    pool = None
+    if args.workers > 1:
+        # each process sections its share of the reports
+        pool = multiprocessing.Pool(args.workers)
+        # imap keeps the study order, so the output is deterministic
+        results = pool.imap(section_study, studies, chunksize=64)
+    else:
+        results = map(section_study, studies)
 
     # write distinct files to facilitate modular processing by chexpert
-    if len(patient_studies) > 0:
-        n = 0
-        jmp = 10000
-
-        while n < len(patient_studies):
-            n_fn = n // jmp
-            with open(output_path / f'mimic_cxr_{n_fn:03d}.csv', 'w') as fp:
-                csvwriter = csv.writer(fp)
-                for row in patient_studies[n:n+jmp]:
-                    csvwriter.writerow(row)
-            n += jmp
+    # rows are written as they come, so memory stays flat
+    writer = ShardWriter(output_path, args.shard_size)
+    try:
+        for study_path, (row, found) in tqdm(zip(studies, results),
+                                             total=len(studies)):
+            if not found:
+                print(f'no impression/findings: {study_path}')
+            writer.writerow(row)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 if __name__ == '__main__':
@@ -1,65 +1,147 @@
 
 import re
-
-
-def section_text(text):
-    """Splits text into sections.
-
-    Assumes text is in a radiology report format, e.g.:
-
-        COMPARISON:  Chest radiograph dated XYZ.
-
-        IMPRESSION:  ABC...
-
-    Given text like this, it will output text from each section, 
-    where the section type is determined by the all caps header.
-
-    Returns a three element tuple:
-        sections - list containing the text of each section
-        section_names - a normalized version of the section name
-        section_idx - list of start indices of the text in the section
+from functools import lru_cache
+
+
+# All caps header starting a section, e.g. "\n IMPRESSION: ".
+P_SECTION = re.compile(
+    r'\n ([A-Z ()/,-]+):\s', re.DOTALL)
+# Any character kept by str.strip, to find sections with text.
+P_NON_SPACE = re.compile(r'\S')
+# Separator of the paragraphs of a section.
+PARAGRAPH_BREAK = '\n \n'
+
+FREQUENT_SECTIONS = {
+    "preamble": "preamble",  # 227885
+    "impression": "impression",  # 187759
+    "comparison": "comparison",  # 154647
+    "indication": "indication",  # 153730
+    "findings": "findings",  # 149842
+    "examination": "examination",  # 94094
+    "technique": "technique",  # 81402
+    "history": "history",  # 45624
+    "comparisons": "comparison",  # 8686
+    "clinical history": "history",  # 7121
+    "reason for examination": "indication",  # 5845
+    "notification": "notification",  # 5749
+    "reason for exam": "indication",  # 4430
+    "clinical information": "history",  # 4024
+    "exam": "examination",  # 3907
+    "clinical indication": "indication",  # 1945
+    "conclusion": "impression",  # 1802
+    "chest, two views": "findings",  # 1735
+    "recommendation(s)": "recommendations",  # 1700
+    "type of examination": "examination",  # 1678
+    "reference exam": "comparison",  # 347
+    "patient history": "history",  # 251
+    "addendum": "addendum",  # 183
+    "comparison exam": "comparison",  # 163
+    "date": "date",  # 108
+    "comment": "comment",  # 88
+    "findings and impression": "impression",  # 87
+    "wet read": "wet read",  # 83
+    "comparison film": "comparison",  # 79
+    "recommendations": "recommendations",  # 72
+    "findings/impression": "impression",  # 47
+    "pfi": "history",
+    'recommendation': 'recommendations',
+    'wetread': 'wet read',
+    'ndication': 'impression',  # 1
+    'impresson': 'impression',  # 2
+    'imprression': 'impression',  # 1
+    'imoression': 'impression',  # 1
+    'impressoin': 'impression',  # 1
+    'imprssion': 'impression',  # 1
+    'impresion': 'impression',  # 1
+    'imperssion': 'impression',  # 1
+    'mpression': 'impression',  # 1
+    'impession': 'impression',  # 3
+    'findings/ impression': 'impression',  # ,1
+    'finding': 'findings',  # ,8
+    'findins': 'findings',
+    'findindgs': 'findings',  # ,1
+    'findgings': 'findings',  # ,1
+    'findngs': 'findings',  # ,1
+    'findnings': 'findings',  # ,1
+    'finidngs': 'findings',  # ,2
+    'idication': 'indication',  # ,1
+    'reference findings': 'findings',  # ,1
+    'comparision': 'comparison',  # ,2
+    'comparsion': 'comparison',  # ,1
+    'comparrison': 'comparison',  # ,1
+    'comparisions': 'comparison'  # ,1
+}
+
+FINDINGS_PHRASES = [
+    'chest',
+    'portable',
+    'pa and lateral',
+    'lateral and pa',
+    'ap and lateral',
+    'lateral and ap',
+    'frontal and',
+    'two views',
+    'frontal view',
+    'pa view',
+    'ap view',
+    'one view',
+    'lateral view',
+    'bone window',
+    'frontal upright',
+    'frontal semi-upright',
+    'ribs',
+    'pa and lat'
+]
+P_FINDINGS = re.compile('({})'.format('|'.join(FINDINGS_PHRASES)))
+
+MAIN_SECTIONS = [
+    'impression', 'findings', 'history', 'comparison',
+    'addendum'
+]
+
+
+def iter_sections(text):
+    """Scan text once for its sections.
+
+    Yields a (name, start, end) tuple for each section, with the header
+    name as written, and the span of its text in the report.
     """
-    p_section = re.compile(
-        r'\n ([A-Z ()/,-]+):\s', re.DOTALL)
+    s = P_SECTION.search(text)
 
-    sections = list()
-    section_names = list()
-    section_idx = list()
+    if s is None:
+        yield 'full report', 0, len(text)
+        return
 
-    idx = 0
-    s = p_section.search(text, idx)
+    yield 'preamble', 0, s.start(1)
 
-    if s:
-        sections.append(text[0:s.start(1)])
-        section_names.append('preamble')
-        section_idx.append(0)
+    while s:
+        current_section = s.group(1).lower()
+        # get the start of the text for this section
+        idx_start = s.end()
+        # skip past the first newline to avoid some bad parses
+        idx_skip = text.find('\n', idx_start)
+        if idx_skip == -1:
+            idx_skip = idx_start
 
-        while s:
-            current_section = s.group(1).lower()
-            # get the start of the text for this section
-            idx_start = s.end()
-            # skip past the first newline to avoid some bad parses
-            idx_skip = text[idx_start:].find('\n')
-            if idx_skip == -1:
-                idx_skip = 0
+        s = P_SECTION.search(text, idx_skip)
 
-            s = p_section.search(text, idx_start + idx_skip)
+        if s is None:
+            idx_end = len(text)
+        else:
+            idx_end = s.start()
 
-            if s is None:
-                idx_end = len(text)
-            else:
-                idx_end = s.start()
+        yield current_section, idx_start, idx_end
 
-            sections.append(text[idx_start:idx_end])
-            section_names.append(current_section)
-            section_idx.append(idx_start)
 
-    else:
-        sections.append(text)
-        section_names.append('full report')
-        section_idx.append(0)
+def section_spans(text):
+    """Split text into normalized sections without copying their text.
 
-    section_names = normalize_section_names(section_names)
+    Returns a list of (section_name, start, end, section_idx) tuples,
+    where text[start:end] is the text of the section and section_idx
+    the start index reported by section_text.
+    """
+    spans = [(normalize_section_name(name), start, end, start)
+             for name, start, end in iter_sections(text)]
 
     # remove empty sections
     # this handles when the report starts with a finding-like statement
@@ -70,140 +152,75 @@ def section_text(text):
     #    INDICATION:   This is the actual section ....
     # it also helps when there are multiple findings sections
     # usually one is empty
-    for i in reversed(range(len(section_names))):
-        if section_names[i] in ('impression', 'findings'):
-            if sections[i].strip() == '':
-                sections.pop(i)
-                section_names.pop(i)
-                section_idx.pop(i)
+    spans = [span for span in spans
+             if span[0] not in ('impression', 'findings') or
+             P_NON_SPACE.search(text, span[1], span[2])]
 
+    section_names = [span[0] for span in spans]
     if ('impression' not in section_names) & ('findings' not in section_names):
         # create a new section for the final paragraph
-        if '\n \n' in sections[-1]:
-            sections.append('\n \n'.join(sections[-1].split('\n \n')[1:]))
-            sections[-2] = sections[-2].split('\n \n')[0]
-            section_names.append('last_paragraph')
-            section_idx.append(section_idx[-1] + len(sections[-2]))
+        name, start, end, idx = spans[-1]
+        idx_break = text.find(PARAGRAPH_BREAK, start, end)
+        if idx_break != -1:
+            spans[-1] = (name, start, idx_break, idx)
+            spans.append(('last_paragraph', idx_break + len(PARAGRAPH_BREAK),
+                          end, idx_break))
+
+    return spans
+
+
+def section_text(text):
+    """Splits text into sections.
+
+    Assumes text is in a radiology report format, e.g.:
 
+        COMPARISON:  Chest radiograph dated XYZ.
+
+        IMPRESSION:  ABC...
+
+    Given text like this, it will output text from each section, 
+    where the section type is determined by the all caps header.
+
+    Returns a three element tuple:
+        sections - list containing the text of each section
+        section_names - a normalized version of the section name
+        section_idx - list of start indices of the text in the section
+    """
+    spans = section_spans(text)
+    sections = [text[start:end] for _, start, end, _ in spans]
+    section_names = [name for name, _, _, _ in spans]
+    section_idx = [idx for _, _, _, idx in spans]
     return sections, section_names, section_idx
 
 
 def normalize_section_names(section_names):
-    # first, lower case all
-    section_names = [s.lower().strip() for s in section_names]
-
-    frequent_sections = {
-        "preamble": "preamble",  # 227885
-        "impression": "impression",  # 187759
-        "comparison": "comparison",  # 154647
-        "indication": "indication",  # 153730
-        "findings": "findings",  # 149842
-        "examination": "examination",  # 94094
-        "technique": "technique",  # 81402
-        "history": "history",  # 45624
-        "comparisons": "comparison",  # 8686
-        "clinical history": "history",  # 7121
-        "reason for examination": "indication",  # 5845
-        "notification": "notification",  # 5749
-        "reason for exam": "indication",  # 4430
-        "clinical information": "history",  # 4024
-        "exam": "examination",  # 3907
-        "clinical indication": "indication",  # 1945
-        "conclusion": "impression",  # 1802
-        "chest, two views": "findings",  # 1735
-        "recommendation(s)": "recommendations",  # 1700
-        "type of examination": "examination",  # 1678
-        "reference exam": "comparison",  # 347
-        "patient history": "history",  # 251
-        "addendum": "addendum",  # 183
-        "comparison exam": "comparison",  # 163
-        "date": "date",  # 108
-        "comment": "comment",  # 88
-        "findings and impression": "impression",  # 87
-        "wet read": "wet read",  # 83
-        "comparison film": "comparison",  # 79
-        "recommendations": "recommendations",  # 72
-        "findings/impression": "impression",  # 47
-        "pfi": "history",
-        'recommendation': 'recommendations',
-        'wetread': 'wet read',
-        'ndication': 'impression',  # 1
-        'impresson': 'impression',  # 2
-        'imprression': 'impression',  # 1
-        'imoression': 'impression',  # 1
-        'impressoin': 'impression',  # 1
-        'imprssion': 'impression',  # 1
-        'impresion': 'impression',  # 1
-        'imperssion': 'impression',  # 1
-        'mpression': 'impression',  # 1
-        'impession': 'impression',  # 3
-        'findings/ impression': 'impression',  # ,1
-        'finding': 'findings',  # ,8
-        'findins': 'findings',
-        'findindgs': 'findings',  # ,1
-        'findgings': 'findings',  # ,1
-        'findngs': 'findings',  # ,1
-        'findnings': 'findings',  # ,1
-        'finidngs': 'findings',  # ,2
-        'idication': 'indication',  # ,1
-        'reference findings': 'findings',  # ,1
-        'comparision': 'comparison',  # ,2
-        'comparsion': 'comparison',  # ,1
-        'comparrison': 'comparison',  # ,1
-        'comparisions': 'comparison'  # ,1
-    }
+    return [normalize_section_name(s) for s in section_names]
 
-    p_findings = [
-        'chest',
-        'portable',
-        'pa and lateral',
-        'lateral and pa',
-        'ap and lateral',
-        'lateral and ap',
-        'frontal and',
-        'two views',
-        'frontal view',
-        'pa view',
-        'ap view',
-        'one view',
-        'lateral view',
-        'bone window',
-        'frontal upright',
-        'frontal semi-upright',
-        'ribs',
-        'pa and lat'
-    ]
-    p_findings = re.compile('({})'.format('|'.join(p_findings)))
-
-    main_sections = [
-        'impression', 'findings', 'history', 'comparison',
-        'addendum'
-    ]
-    for i, s in enumerate(section_names):
-        if s in frequent_sections:
-            section_names[i] = frequent_sections[s]
-            continue
-
-        main_flag = False
-        for m in main_sections:
-            if m in s:
-                section_names[i] = m
-                main_flag = True
-                break
-        if main_flag:
-            continue
-
-        m = p_findings.search(s)
-        if m is not None:
-            section_names[i] = 'findings'
-
-        # if it looks like it is describing the entire study
-        # it's equivalent to findings
-        # group similar phrasings for impression
-
-    return section_names
 
+@lru_cache(maxsize=None)
+def normalize_section_name(section_name):
+    # first, lower case
+    s = section_name.lower().strip()
 
+    if s in FREQUENT_SECTIONS:
+        return FREQUENT_SECTIONS[s]
+
+    for m in MAIN_SECTIONS:
+        if m in s:
+            return m
+
+    m = P_FINDINGS.search(s)
+    if m is not None:
+        return 'findings'
+
+    # if it looks like it is describing the entire study
+    # it's equivalent to findings
+    # group similar phrasings for impression
+
+    return s
+
+
+@lru_cache(maxsize=None)
 def custom_mimic_cxr_rules():
     custom_section_names = {
         's50913680': 'recommendations',  # files/p11/p11851243/s50913680.txt
@@ -268,3 +285,47 @@ def custom_mimic_cxr_rules():
     }
 
     return custom_section_names, custom_indices
+
+
+def list_rindex(l, s):
+    """Helper function: *last* matching element in a list"""
+    return len(l) - l[-1::-1].index(s) - 1
+
+
+def extract_impression(text, study=None):
+    """Extract the impression, or the best section standing in for it.
+
+    The custom rules of MIMIC-CXR apply when the study name, e.g.
+    s50913680, is given. Returns None when no section is found.
+    """
+    custom_section_names, custom_indices = custom_mimic_cxr_rules()
+
+    # custom rules for some poorly formatted reports
+    if study in custom_indices:
+        idx = custom_indices[study]
+        return text[idx[0]:idx[1]]
+
+    # split text into sections, only the chosen one is copied
+    spans = section_spans(text)
+    section_names = [name for name, _, _, _ in spans]
+
+    # check to see if this has mis-named sections
+    # e.g. sometimes the impression is in the comparison section
+    if study in custom_section_names:
+        sn = custom_section_names[study]
+        _, start, end, _ = spans[list_rindex(section_names, sn)]
+        return text[start:end].strip()
+
+    # grab the *last* section with the given title
+    # prioritize impression > findings > last paragraph > comparison
+
+    # note comparison seems unusual but if no other sections
+    # exist the radiologist has usually written the
+    # report in the comparison section
+    for sn in ('impression', 'findings', 'last_paragraph', 'comparison'):
+        if sn in section_names:
+            _, start, end, _ = spans[list_rindex(section_names, sn)]
+            return text[start:end].strip()
+
+    # we didn't find anything :(
+    return None
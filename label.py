@@ -1,100 +1,411 @@
 """Entry-point script to label radiology reports."""
 from pathlib import Path
+import copy
+import math
+import multiprocessing
+import multiprocessing.util
 import os
 import sys
 from datetime import datetime
-import pandas as pd
+import bioc
+import numpy as np
+from tqdm import tqdm
 
 from args import ArgParser
+from checkpoint import Manifest, ShardLock, LockLostError
 from loader import Loader
+from profiling import Tracer, Profiler, RuleStats, NULL_TRACER
 from stages import Extractor, Classifier, Aggregator
+from writer import open_writer, CSV, SUFFIXES
 from constants import *
 
+# Number of shards handed to each worker, to balance uneven reports.
+SHARDS_PER_WORKER = 4
 
-def write(reports, labels, output_path, verbose=False):
-    """Write labeled reports to specified path."""
-    labeled_reports = pd.DataFrame({REPORTS: reports})
-    for index, category in enumerate(CATEGORIES):
-        labeled_reports[category] = labels[:, index]
+# Outcome of labeling one file of a folder.
+LABELED = "labeled"
+SKIPPED = "skipped"
+CLAIMED = "claimed elsewhere"
+FAILED = "failed"
 
+# Pipeline objects of a worker process, loaded once by init_worker.
+worker_objects = None
+
+# Tracer and rule statistics of this process, set up by prep_profiling.
+tracer = NULL_TRACER
+rule_stats = None
+
+
+def write(writer, start, reports, labels, ids=None, verbose=False):
+    """Write labeled reports starting at input row start, keyed by their
+    input IDs when given."""
     if verbose:
-        print(f"Writing reports and labels to {output_path}.")
-    labeled_reports[[REPORTS] + CATEGORIES].to_csv(output_path,
-                                                   index=False)
+        print(f"Writing reports and labels to {writer.output_path}.")
+    writer.write(start, reports, labels, ids)
+
+
+def process_path(path, worker=False):
+    """Give each worker process its own output next to the given path."""
+    if worker:
+        return path.with_suffix(f'.{os.getpid()}{path.suffix}')
+    return path
+
+
+def prep_profiling(args, worker=False):
+    """Set up the tracer and rule statistics of this process, when on."""
+    global tracer, rule_stats
+    if getattr(args, 'trace_path', None) is not None:
+        tracer = Tracer(process_path(args.trace_path, worker), args.slowest)
+    if getattr(args, 'rule_stats_path', None) is not None:
+        rule_stats = RuleStats()
+
+
+def close_profiling(args, worker=False):
+    """Write the trace and rule statistics of this process."""
+    tracer.close()
+    # Without a detector, as in the main process of a pool, there are no
+    # rules to report.
+    if rule_stats is not None and rule_stats.sources:
+        rule_stats.write(process_path(args.rule_stats_path, worker))
 
 
 def prep_objects(args):
     extractor = Extractor(args.mention_phrases_dir,
                           args.unmention_phrases_dir,
-                          verbose=args.verbose)
+                          verbose=args.verbose,
+                          tracer=tracer)
     classifier = Classifier(args.pre_negation_uncertainty_path,
                             args.negation_path,
                             args.post_negation_uncertainty_path,
-                            verbose=args.verbose)
+                            parse_cache_dir=args.parse_cache_dir,
+                            sentence_cache_size=args.sentence_cache_size,
+                            verbose=args.verbose,
+                            tracer=tracer,
+                            rule_stats=rule_stats)
     aggregator = Aggregator(CATEGORIES,
-                            verbose=args.verbose)
+                            verbose=args.verbose,
+                            tracer=tracer)
     return extractor, classifier, aggregator
 
 
-def label(args, extractor, classifier, aggregator):
-    """Label the provided report(s)."""
-    # Load the reports
-    loader = Loader(args.reports_path, args.extract_impression)
+def init_worker(args):
+    """Load the parser and patterns once in each worker process."""
+    global worker_objects
+    # Progress is reported by the main process instead.
+    args = copy.copy(args)
+    args.verbose = False
+    prep_profiling(args, worker=True)
+    # Pool workers exit without running atexit, so write the outputs here.
+    multiprocessing.util.Finalize(None, close_profiling, args=(args, True),
+                                  exitpriority=10)
+    worker_objects = prep_objects(args)
 
-    # Extract observation mentions in place.
-    extractor.extract(loader.collection)
-    # Classify mentions in place.
-    classifier.classify(loader.collection)
+
+def prep_pipeline(args):
+    """Load the pipeline objects here, or in each worker of a pool."""
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers,
+                                    initializer=init_worker,
+                                    initargs=(args,))
+        return None, None, None, pool
+
+    return prep_objects(args) + (None,)
+
+
+def run_documents(documents, extractor, classifier):
+    """Extract and classify the mentions of each document, yielding it to
+    be aggregated and then releasing it."""
+    for i, document in enumerate(documents):
+        # Extract observation mentions in place.
+        extractor.extract_document(document)
+        # Classify mentions in place.
+        classifier.classify_document(document)
+        yield document
+        # Only the labels of an aggregated document are kept.
+        documents[i] = None
+
+
+def run_stages(collection, extractor, classifier, aggregator):
+    """Label every document of a collection.
+
+    Each document runs through all stages before the next one, so its
+    BioC objects are freed as soon as it is labeled; the collection is
+    emptied on the way.
+    """
+    documents = run_documents(collection.documents, extractor, classifier)
+    if extractor.verbose:
+        print("Labeling reports...")
+        documents = tqdm(documents, total=len(collection.documents))
     # Aggregate mentions to obtain one set of labels for each report.
-    labels = aggregator.aggregate(loader.collection)
+    labels = aggregator.aggregate_documents(documents,
+                                            len(collection.documents))
+    classifier.finish()
+    del collection.documents[:]
+    tracer.flush()
+    return labels
+
+
+def label_shard(task):
+    """Label a shard of documents of an input file in a worker process."""
+    input_path, documents = task
+    tracer.set_input(input_path)
+    collection = bioc.BioCCollection()
+    for document in documents:
+        collection.add_document(document)
+
+    return run_stages(collection, *worker_objects)
+
+
+def run_stages_parallel(collection, pool, workers, verbose=False,
+                        input_path=None):
+    """Label a collection by sharding its documents across a pool."""
+    documents = collection.documents
+    shard_size = max(1, math.ceil(len(documents) /
+                                  (workers * SHARDS_PER_WORKER)))
+    shards = [(input_path, documents[i:i + shard_size])
+              for i in range(0, len(documents), shard_size)]
+
+    # imap yields results in submission order, so labels follow the reports.
+    results = pool.imap(label_shard, shards)
+    if verbose:
+        print(f"Labeling reports with {workers} workers...")
+        results = tqdm(results, total=len(shards))
+    labels = list(results)
+
+    if len(labels) == 0:
+        return np.empty((0, len(CATEGORIES)), dtype=np.float32)
+    return np.concatenate(labels)
+
+
+def label_collection(args, collection, extractor, classifier, aggregator,
+                     pool=None):
+    """Label a collection in this process, or across the pool."""
+    if pool is None:
+        return run_stages(collection, extractor, classifier, aggregator)
+
+    return run_stages_parallel(collection, pool,
+                               args.workers, args.verbose,
+                               str(args.reports_path))
+
+
+def label(args, extractor, classifier, aggregator, pool=None, start=0,
+          progress=None, before_write=None):
+    """Label the provided report(s).
+
+    Reports before `start` were labeled by an earlier run and are skipped.
+    Before each write, `before_write` is called, and may raise to leave
+    the output alone. After each write, `progress` is called with the
+    number of reports labeled so far.
+    """
+    # documents are numbered per input file, so the trace names it
+    tracer.set_input(args.reports_path)
+    writer = open_writer(args.output_format, args.output_path,
+                         include_reports=not args.omit_reports,
+                         append=start > 0)
+    try:
+        if args.chunk_size is not None:
+            label_chunks(args, writer, extractor, classifier, aggregator,
+                         pool, start, progress, before_write)
+            return
+
+        # Load the reports
+        loader = Loader(args.reports_path, args.extract_impression,
+                        args.extension, tracer=tracer, verbose=args.verbose,
+                        impression_rules=args.impression_rules,
+                        missing_impression=args.missing_impression,
+                        io_workers=args.io_workers)
+        loader.skip(start)
+
+        labels = label_collection(args, loader.collection,
+                                  extractor, classifier, aggregator, pool)
+
+        if before_write is not None:
+            before_write()
+        write(writer, start, loader.reports, loader.expand(labels),
+              loader.index, args.verbose)
+        if progress is not None:
+            progress(start + len(loader.reports))
+    finally:
+        writer.close()
 
-    write(loader.reports, labels, args.output_path, args.verbose)
+
+def label_chunks(args, writer, extractor, classifier, aggregator, pool=None,
+                 start=0, progress=None, before_write=None):
+    """Label the provided report(s) one chunk at a time.
+
+    Each chunk is appended to the output as soon as it is labeled, so
+    memory stays bounded and finished chunks survive a crash.
+    """
+    loader = Loader(args.reports_path, args.extract_impression,
+                    args.extension, chunk_size=args.chunk_size,
+                    tracer=tracer, verbose=args.verbose,
+                    impression_rules=args.impression_rules,
+                    missing_impression=args.missing_impression,
+                    io_workers=args.io_workers)
+    for chunk in loader.iter_chunks(start):
+        labels = label_collection(args, chunk.collection,
+                                  extractor, classifier, aggregator, pool)
+        if before_write is not None:
+            before_write()
+        write(writer, chunk.start, chunk.reports, chunk.expand(labels),
+              chunk.index, args.verbose)
+        if progress is not None:
+            progress(chunk.start + len(chunk.reports))
+
+
+def label_file(args, f, out_path, out_prefix,
+               extractor, classifier, aggregator, pool=None):
+    """Label one CSV of the input folder, checkpointing its progress.
+
+    Return:
+        (str, int): outcome for the file and number of reports labeled
+    """
+    file_args = copy.copy(args)
+    file_args.reports_path = args.reports_path / f
+    file_args.output_path = out_path / (out_prefix + f)
+    if args.output_format != CSV:
+        file_args.output_path = file_args.output_path.with_suffix(
+            SUFFIXES[args.output_format])
+    manifest = Manifest(out_path / CHECKPOINT_DIR)
+
+    lock = None
+    if args.claim_shards:
+        lock = ShardLock(manifest.lock_path(f), args.lock_timeout)
+        if not lock.acquire():
+            return CLAIMED, 0
+
+    try:
+        # claimed shards are shared between runs, so always resume them
+        checkpoint = manifest.checkpoint(f, file_args.reports_path,
+                                         file_args.output_path,
+                                         args.resume or args.claim_shards)
+        if checkpoint.complete:
+            return SKIPPED, 0
+        # only CSV outputs can be continued, the others are relabeled
+        if args.output_format != CSV:
+            checkpoint.restart()
+        start = checkpoint.rows
+
+        # a shard taken over by another run is left to it, so neither its
+        # output nor its record is touched again; the lock itself is kept
+        # fresh by its heartbeat
+        before_write = lock.check if lock is not None else None
+
+        def progress(rows):
+            if lock is not None:
+                lock.check()
+            checkpoint.update(rows)
+
+        try:
+            label(file_args, extractor, classifier, aggregator, pool,
+                  start=start, progress=progress, before_write=before_write)
+            if lock is not None:
+                lock.check()
+            checkpoint.finish()
+        except LockLostError:
+            print('Lost the lock of file {}'.format(f))
+            return CLAIMED, checkpoint.rows - start
+        except Exception as error:
+            checkpoint.fail(error)
+            print('Error on file {}'.format(f))
+            with open('error.log', 'a') as fp:
+                fp.write('{}\n'.format(f))
+            return FAILED, checkpoint.rows - start
+
+        return LABELED, checkpoint.rows - start
+    finally:
+        if lock is not None:
+            lock.release()
+
+
+def label_file_in_worker(task):
+    """Label one CSV of the input folder in a worker process."""
+    args, f, out_path, out_prefix = task
+    return (f,) + label_file(args, f, out_path, out_prefix, *worker_objects)
+
+
+def list_csvs(reports_path):
+    """List the CSVs of a folder, in sorted order."""
+    return sorted(x for x in os.listdir(reports_path) if x[-4:] == '.csv')
+
+
+def label_folder(args):
+    """Label every CSV of a folder, one file per worker."""
+    if os.path.isdir(args.output_path):
+        out_prefix = 'labeled_'
+        out_path = args.output_path
+    else:
+        out_prefix = args.output_path.stem
+        out_path = args.output_path.parents[0]
+
+    report_files = list_csvs(args.reports_path)
+    N = len(report_files)
+    if N == 0:
+        print('Empty folder given for parsing. ' +
+              'Input path must be a single CSV, or a folder of CSVs.')
+        sys.exit()
+
+    if args.verbose:
+        now = datetime.now().strftime("%Y-%m-%d %H:%M")
+        print('{} - Parsing {} files.'.format(now, N))
+
+    pool = None
+    if args.workers > 1:
+        # each worker labels whole files with its own pipeline objects
+        pool = multiprocessing.Pool(args.workers,
+                                    initializer=init_worker,
+                                    initargs=(args,))
+        # progress is reported here, per file, instead of by the workers
+        worker_args = copy.copy(args)
+        worker_args.verbose = False
+        tasks = [(worker_args, f, out_path, out_prefix)
+                 for f in report_files]
+        results = pool.imap_unordered(label_file_in_worker, tasks)
+    else:
+        extractor, classifier, aggregator = prep_objects(args)
+        results = ((f,) + label_file(args, f, out_path, out_prefix,
+                                     extractor, classifier, aggregator)
+                   for f in report_files)
+
+    n_reports = 0
+    for i, (f, outcome, rows) in enumerate(results):
+        n_reports += rows
+        now = datetime.now().strftime("%Y-%m-%d %H:%M")
+        if args.verbose:
+            print('{} - Finished {} of {} ({:3.2f}%), {} {}; '
+                  '{} reports labeled.'.format(
+                      now, i+1, N, float(i+1)/N*100.0,
+                      f, outcome, n_reports))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
     parser = ArgParser()
     args = parser.parse_args()
 
-    # check if folder is passed as input
-    # in this case parse each text file individually
-    if os.path.isdir(args.reports_path):
-        base_path = args.reports_path
-        if os.path.isdir(args.output_path):
-            out_prefix = 'labeled_'
-            out_path = args.output_path
-        else:
-            out_prefix = args.output_path.stem
-            out_path = args.output_path.parents[0]
-
-        report_files = os.listdir(base_path)
-        report_files = [x for x in report_files if x[-4:] == '.csv']
-        N = len(report_files)
-        if N == 0:
-            print('Empty folder given for parsing. ' +
-                  'Input path must be a single CSV, or a folder of CSVs.')
-            sys.exit()
-
-        if args.verbose:
-            now = datetime.now().strftime("%Y-%m-%d %H:%M")
-            print('{} - Parsing {} files.'.format(now, N))
+    prep_profiling(args)
+    profiler = None
+    if args.profile is not None:
+        profiler = Profiler(args.profile, args.profile_path)
+        profiler.start()
 
-        extractor, classifier, aggregator = prep_objects(args)
-        for i, f in enumerate(report_files):
-            f_out = out_prefix + f
-            # update output paths for this folder
-            args.reports_path = base_path / f
-            args.output_path = out_path / f_out
-            try:
-                label(args, extractor, classifier, aggregator)
-            except:
-                print('Error on file {}'.format(f))
-                with open('error.log', 'a') as fp:
-                    fp.write('{}\n'.format(f))
-
-            now = datetime.now().strftime("%Y-%m-%d %H:%M")
-            if args.verbose:
-                print('{} - Finished {} of {} ({:3.2f}%).'.format(
-                      now, i+1, N, float(i+1)/N*100.0))
+    # check if folder of CSVs is passed as input
+    # in this case parse each CSV file individually
+    # a folder without CSVs holds one report per file with --extension
+    if (os.path.isdir(args.reports_path) and
+            list_csvs(args.reports_path)):
+        label_folder(args)
     else:
-        extractor, classifier, aggregator = prep_objects(args)
-        label(args, extractor, classifier, aggregator)
+        extractor, classifier, aggregator, pool = prep_pipeline(args)
+        label(args, extractor, classifier, aggregator, pool)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if profiler is not None:
+        profiler.stop()
+    close_profiling(args)
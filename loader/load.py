@@ -1,25 +1,71 @@
 """Define report loader class."""
 import re
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import bioc
+import numpy as np
 import pandas as pd
 from negbio.pipeline import text2bioc, ssplit, section_split
 from tqdm import tqdm
 
 from constants import *
+from etc import section_parser
+from profiling import NULL_TRACER
+
+# `and/or`, and any `XXX/YYY` between letters, both rewritten with `or`.
+SLASH_PATTERN = re.compile('and/or|(?<=[a-zA-Z])/(?=[a-zA-Z])')
+# Joins the reports cleaned together; it is left alone by every step.
+BATCH_SEPARATOR = '\x00'
+
+# Rules finding the impression: NegBio's section splitter on the cleaned
+# document, or the MIMIC-CXR section parser on the raw report.
+NEGBIO_SECTIONS = 'negbio'
+MIMIC_SECTIONS = 'mimic'
+# Handling of a report without an impression: leave its labels empty,
+# label the full report, or fail.
+MISSING_SKIP = 'skip'
+MISSING_FULL = 'full'
+MISSING_ERROR = 'error'
+# Report files read ahead of the consumer by each reading thread.
+READ_AHEAD = 4
 
 
 class Loader(object):
-    """Report impression loader."""
+    """Report impression loader.
+
+    Reports identical once cleaned share one document of the collection;
+    `expand` maps the labels of the documents back to every report.
+    Reports skipped for lacking an impression are expanded to empty labels.
+    """
 
-    def __init__(self, reports_path, extract_impression=False, extension='txt'):
+    def __init__(self, reports_path, extract_impression=False, extension='txt',
+                 chunk_size=None, tracer=NULL_TRACER, verbose=False,
+                 impression_rules=NEGBIO_SECTIONS,
+                 missing_impression=MISSING_SKIP, io_workers=8):
         self.reports_path = reports_path
         self.extract_impression = extract_impression
+        self.impression_rules = impression_rules
+        self.missing_impression = missing_impression
+        self.io_workers = io_workers
         self.punctuation_spacer = str.maketrans({key: f"{key} "
                                                  for key in ".,"})
         self.splitter = ssplit.NegBioSSplitter(newline=False)
         self.extension = extension
+        self.chunk_size = chunk_size
+        self.tracer = tracer
+        self.verbose = verbose
+        # Position of the first loaded report within the input.
+        self.start = 0
+
+        if reports_path is None:
+            # reports are passed in memory through load_reports
+            return
+        if chunk_size is not None:
+            # reports are loaded chunk by chunk through iter_chunks
+            return
 
         if os.path.isdir(reports_path):
             # load in all radiology reports in a folder
@@ -30,31 +76,105 @@ class Loader(object):
 
         self.prep_collection()
 
-    def load_files(self):
-        """Load and clean many reports stored in a folder"""
-        files = os.listdir(self.reports_path)
-        files = [f for f in files if f.endswith(self.extension)]
+    def iter_chunks(self, start=0):
+        """Load the reports one chunk of `chunk_size` reports at a time.
+
+        Yields the loader itself once each chunk is loaded, with `reports`,
+        `index` and `collection` holding that chunk only. The first `start`
+        reports are skipped.
+        """
+        if os.path.isdir(self.reports_path):
+            files = self.list_files()[start:]
+            # Later chunks are read while earlier ones are labeled.
+            reports = self.iter_files(files)
+            for offset in range(0, len(files), self.chunk_size):
+                self.start = start + offset
+                self.index = files[offset:offset + self.chunk_size]
+                self.reports = list(islice(reports, len(self.index)))
+                self.prep_collection()
+                yield self
+        else:
+            chunks = self.read_csv(chunksize=self.chunk_size)
+            self.start = 0
+            for chunk in chunks:
+                if self.start + len(chunk) <= start:
+                    self.start += len(chunk)
+                    continue
+                if self.start < start:
+                    chunk = chunk.iloc[start - self.start:]
+                    self.start = start
+                self.load_frame(chunk)
+                self.prep_collection()
+                yield self
+                self.start += len(chunk)
+
+    def list_files(self):
+        """List the report files stored in a folder, in sorted order."""
+        # scandir lists names without a stat of every file.
+        with os.scandir(self.reports_path) as entries:
+            files = [entry.name for entry in entries
+                     if entry.name.endswith(self.extension)]
         assert len(files) > 0,\
             ('Folder with reports must contain at '
              f'least one ".{self.extension}" file')
 
         files.sort()
+        return files
 
-        # if args.verbose:
-        files = tqdm(files)
-        print('Collecting reports from files...')
+    def load_files(self):
+        """Load and clean many reports stored in a folder"""
+        self.read_files(self.list_files())
+
+    def read_files(self, files):
+        """Read the given report files from the folder."""
+        if self.verbose:
+            print('Collecting reports from files...')
 
         # assume one report per file
-        self.reports = list()
-        self.index = list()
-        for f in tqdm(files, total=len(files)):
-            with open(self.reports_path / f, 'r') as fp:
-                self.reports.append(''.join(fp.readlines()))
-            self.index.append(f)
+        self.reports = list(tqdm(self.iter_files(files), total=len(files),
+                                 disable=not self.verbose))
+        self.index = list(files)
+
+    def iter_files(self, files):
+        """Read the given report files from the folder, in order.
+
+        Files are read by a pool of `io_workers` threads, each at most
+        `READ_AHEAD` files ahead of the consumer, so slow storage is read
+        concurrently without holding the whole folder in memory.
+        """
+        files = iter(files)
+        with ThreadPoolExecutor(max_workers=self.io_workers) as executor:
+            pending = deque(executor.submit(self.read_file, f)
+                            for f in islice(files,
+                                            self.io_workers * READ_AHEAD))
+            while pending:
+                report = pending.popleft().result()
+                for f in islice(files, 1):
+                    pending.append(executor.submit(self.read_file, f))
+                yield report
+
+    def read_file(self, f):
+        """Read one report file from the folder."""
+        with open(self.reports_path / f, 'r') as fp:
+            return fp.read()
 
     def load_csv(self):
         """Load and clean the reports."""
-        reports = pd.read_csv(self.reports_path, header=None)
+        reports = self.read_csv()
+        self.load_frame(reports)
+
+    def read_csv(self, **kwargs):
+        """Read the CSV of reports, as a whole or in chunks.
+
+        The first column, the ID of a two column CSV, is kept as written,
+        so IDs keep leading zeros and one type across chunks, and missing
+        values are read as empty strings.
+        """
+        return pd.read_csv(self.reports_path, header=None, dtype={0: str},
+                           keep_default_na=False, **kwargs)
+
+    def load_frame(self, reports):
+        """Load the reports of a data frame read from the CSV."""
         # allow users to input
         #  (1) single column CSV or reports
         #  (2) two columns; first is the index, second is the report
@@ -72,64 +192,179 @@ class Loader(object):
         self.reports = ['' if type(x) is not str else x
                         for x in reports]
 
+    def load_reports(self, reports):
+        """Load reports given as a list of strings."""
+        self.start = 0
+        self.index = None
+        self.reports = ['' if type(x) is not str else x
+                        for x in reports]
+
     def prep_collection(self):
         """Apply splitter and create bioc collection"""
         collection = bioc.BioCCollection()
-        for i, report in enumerate(self.reports):
-            clean_report = self.clean(report)
-            document = text2bioc.text2document(str(i), clean_report)
+        # Reports whose labels are left empty.
+        self.skipped = np.zeros(len(self.reports), dtype=bool)
+        if self.extract_impression and \
+                self.impression_rules == MIMIC_SECTIONS:
+            impressions = [self.impression_text(i, report)
+                           for i, report in enumerate(self.reports)]
+            clean_reports = self.clean_batch(impressions)
+        else:
+            clean_reports = self.clean_batch(self.reports)
+
+        # Only the first of the reports identical once cleaned is labeled.
+        unique = {}
+        first_rows = []
+        inverse = []
+        for i, clean_report in enumerate(clean_reports):
+            document_index = unique.get(clean_report)
+            if document_index is None:
+                document_index = unique[clean_report] = len(first_rows)
+                first_rows.append(i)
+            inverse.append(document_index)
+        # Document of each report.
+        self.inverse = np.array(inverse, dtype=np.intp)
+        if self.verbose and clean_reports:
+            duplicates = len(clean_reports) - len(first_rows)
+            print(f"Labeling {len(first_rows)} unique of "
+                  f"{len(clean_reports)} reports "
+                  f"({duplicates / len(clean_reports):.1%} duplicates).")
 
-            if self.extract_impression:
-                document = section_split.split_document(document)
-                self.extract_impression_from_passages(document)
+        # Documents without an impression, for NegBio's section splitter.
+        skipped_documents = np.zeros(len(first_rows), dtype=bool)
+        for document_index, i in enumerate(first_rows):
+            report = self.reports[i]
+            clean_report = clean_reports[i]
+            document_id = str(self.start + i)
+            with self.tracer.span('load', document_id, length=len(report)):
+                document = text2bioc.text2document(document_id,
+                                                   clean_report)
 
-            split_document = self.splitter.split_doc(document)
+                if self.extract_impression and \
+                        self.impression_rules == NEGBIO_SECTIONS:
+                    document = section_split.split_document(document)
+                    if not self.extract_impression_from_passages(document):
+                        text = self.missing(i, clean_report)
+                        # Duplicates of the report are skipped with it.
+                        skipped_documents[document_index] = self.skipped[i]
+                        document = text2bioc.text2document(document_id,
+                                                           text)
+
+                split_document = self.splitter.split_doc(document)
 
             assert len(split_document.passages) == 1,\
                 ('Each document must have a single passage, ' +
                  'the Impression section.')
 
             collection.add_document(split_document)
+        self.skipped |= skipped_documents[self.inverse]
         self.collection = collection
 
+    def impression_text(self, i, report):
+        """Extract the impression of the i-th report from its raw text,
+        with the rules of the MIMIC-CXR section parser."""
+        study = None
+        if self.index is not None:
+            # Custom rules are keyed by the study, e.g. s50913680.txt.
+            study = os.path.splitext(str(self.index[i]))[0]
+        impression = section_parser.extract_impression(report, study)
+        if impression is None:
+            return self.missing(i, report)
+        return impression
+
+    def missing(self, i, report):
+        """Return the text to label for the i-th report, which has no
+        impression, an empty one, or several."""
+        if self.missing_impression == MISSING_ERROR:
+            raise ValueError(f'Report {self.start + i} contains no '
+                             'single impression section with text.')
+        if self.missing_impression == MISSING_FULL:
+            return report
+        self.skipped[i] = True
+        return ''
+
+    def skip(self, n_reports):
+        """Drop the first n_reports loaded reports, and the documents no
+        remaining report needs."""
+        self.reports = self.reports[n_reports:]
+        if self.index is not None:
+            self.index = self.index[n_reports:]
+        self.skipped = self.skipped[n_reports:]
+        self.start += n_reports
+        # Unique documents keep their order of first occurrence.
+        needed, self.inverse = np.unique(self.inverse[n_reports:],
+                                         return_inverse=True)
+        documents = self.collection.documents
+        self.collection.documents = [documents[i] for i in needed]
+
+    def expand(self, labels):
+        """Expand the labels of the documents to one row per report."""
+        labels = labels[self.inverse]
+        labels[self.skipped] = np.nan
+        return labels
+
     def extract_impression_from_passages(self, document):
-        """Extract the Impression section from a Bioc Document."""
-        impression_passages = []
-        for i, passage in enumerate(document.passages):
-            if 'title' in passage.infons:
-                if passage.infons['title'] == 'impression':
-                    next_passage = document.passages[i+1]
-                    assert 'title' not in next_passage.infons,\
-                        "Document contains empty impression section."
-                    impression_passages.append(next_passage)
+        """Extract the Impression section from a Bioc Document.
 
-        assert len(impression_passages) <= 1,\
-            (f"The document contains {len(document.passages)} impression " +
-             "passages.")
+        Returns whether the document contains a single impression with
+        text; the document is left unchanged when it does not.
+        """
+        passages = document.passages
+        impression_passages = []
+        for i, passage in enumerate(passages):
+            if passage.infons.get('title') == 'impression':
+                # The text of a section is the passage after its title.
+                if i + 1 == len(passages) or \
+                        'title' in passages[i + 1].infons:
+                    # empty impression section
+                    return False
+                impression_passages.append(passages[i + 1])
 
-        assert len(impression_passages) >= 1,\
-            "The document contains no explicit impression passage."
+        if len(impression_passages) != 1:
+            # no impression, or several
+            return False
 
         document.passages = impression_passages
+        return True
 
     def clean(self, report):
         """Clean the report text."""
         lower_report = report.lower()
-        # Change `and/or` to `or`.
-        corrected_report = re.sub('and/or',
-                                  'or',
-                                  lower_report)
-        # Change any `XXX/YYY` to `XXX or YYY`.
-        corrected_report = re.sub('(?<=[a-zA-Z])/(?=[a-zA-Z])',
-                                  ' or ',
-                                  corrected_report)
+        # Change `and/or` to `or`, and any `XXX/YYY` to `XXX or YYY`.
+        if '/' in lower_report:
+            corrected_report = SLASH_PATTERN.sub(self.replace_slash,
+                                                 lower_report)
+        else:
+            corrected_report = lower_report
         # Clean double periods
         clean_report = corrected_report.replace("..", ".")
         # Insert space after commas and periods.
         clean_report = clean_report.translate(self.punctuation_spacer)
         # Convert any multi white spaces to single white spaces.
         clean_report = ' '.join(clean_report.split())
-        # Remove empty sentences
-        clean_report = re.sub(r'\.\s+\.', '.', clean_report)
+        # Remove empty sentences, now separated by a single space.
+        clean_report = clean_report.replace('. .', '.')
 
         return clean_report
+
+    def replace_slash(self, match):
+        """Replace `and/or` with `or`, and a lone slash with ` or `."""
+        return 'or' if len(match.group()) > 1 else ' or '
+
+    def clean_batch(self, reports):
+        """Clean a list or Series of reports at once.
+
+        The reports are joined and cleaned as one text, giving the same
+        text for each report as clean.
+        """
+        reports = list(reports)
+        if not reports:
+            return []
+        text = BATCH_SEPARATOR.join(reports)
+        if text.count(BATCH_SEPARATOR) != max(len(reports) - 1, 0):
+            # The separator occurs in a report.
+            return [self.clean(report) for report in reports]
+
+        clean_reports = self.clean(text).split(BATCH_SEPARATOR)
+        # Spaces around the separator belong to no report.
+        return [clean_report.strip(' ') for clean_report in clean_reports]
@@ -0,0 +1,3 @@
+from .tracer import Tracer, NullTracer, NULL_TRACER
+from .profiler import Profiler
+from .rule_stats import RuleStats
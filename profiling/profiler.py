@@ -0,0 +1,42 @@
+"""Define profiler class."""
+import cProfile
+
+
+class Profiler(object):
+    """Capture a cProfile or pyinstrument profile of the main process.
+
+    cProfile writes pstats data to the output path, readable with
+    `python -m pstats`; pyinstrument, which must be installed, writes an
+    HTML report.
+    """
+
+    def __init__(self, kind, output_path):
+        self.kind = kind
+        self.output_path = output_path
+        if kind == "cprofile":
+            self.profiler = cProfile.Profile()
+        elif kind == "pyinstrument":
+            try:
+                import pyinstrument
+            except ImportError:
+                raise ImportError("pyinstrument must be installed to "
+                                  "profile with it.")
+            self.profiler = pyinstrument.Profiler()
+        else:
+            raise ValueError(f"Unknown profiler {kind}.")
+
+    def start(self):
+        if self.kind == "cprofile":
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self):
+        """Stop profiling and write the profile."""
+        if self.kind == "cprofile":
+            self.profiler.disable()
+            self.profiler.dump_stats(str(self.output_path))
+        else:
+            self.profiler.stop()
+            with open(self.output_path, "w") as f:
+                f.write(self.profiler.output_html())
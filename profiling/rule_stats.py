@@ -0,0 +1,77 @@
+"""Define rule statistics class."""
+import csv
+from collections import defaultdict
+
+
+class RuleStats(object):
+    """Count how often each ngrex rule is evaluated and fires, and its cost.
+
+    An evaluation is one pass of a rule over a sentence graph, covering
+    every mention of the sentence at once, not one try per mention. Rules
+    skipped because the graph lacks a lemma they need are counted apart,
+    as prefiltered; rules left untried once every mention has a match are
+    not counted. Rules are registered per family with the pattern file and
+    line they were loaded from, so the report points back at the rule to
+    edit.
+    """
+
+    def __init__(self):
+        # Family -> list of (path, line, pattern text), in load order.
+        self.sources = {}
+        self.evaluations = defaultdict(int)
+        self.prefiltered = defaultdict(int)
+        self.matches = defaultdict(int)
+        self.mentions = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def add_rules(self, family, sources):
+        """Register the rules of a family."""
+        self.sources[family] = sources
+
+    def record(self, family, index, seconds, mentions):
+        """Record one evaluation of a rule over a sentence graph, which
+        gave its first match to the given number of mentions."""
+        key = (family, index)
+        self.evaluations[key] += 1
+        self.seconds[key] += seconds
+        if mentions:
+            self.matches[key] += 1
+            self.mentions[key] += mentions
+
+    def skip(self, family, index):
+        """Record a rule skipped by the prefilter for a sentence graph."""
+        self.prefiltered[family, index] += 1
+
+    def report(self):
+        """Return one row per rule, the most expensive first."""
+        rows = []
+        for family, sources in self.sources.items():
+            for index, (path, line, pattern) in enumerate(sources):
+                key = (family, index)
+                evaluations = self.evaluations[key]
+                seconds = self.seconds[key]
+                rows.append({
+                    "family": family,
+                    "path": str(path),
+                    "line": line,
+                    "graph_evaluations": evaluations,
+                    "prefiltered": self.prefiltered[key],
+                    "graphs_matched": self.matches[key],
+                    "mentions_matched": self.mentions[key],
+                    "seconds": seconds,
+                    "us_per_graph_evaluation": (seconds / evaluations * 1e6
+                                                if evaluations else 0.0),
+                    "pattern": pattern})
+        rows.sort(key=lambda row: row["seconds"], reverse=True)
+        return rows
+
+    def write(self, output_path):
+        """Write the ranked report as CSV."""
+        rows = self.report()
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=[
+                "family", "path", "line", "graph_evaluations", "prefiltered",
+                "graphs_matched", "mentions_matched", "seconds",
+                "us_per_graph_evaluation", "pattern"])
+            writer.writeheader()
+            writer.writerows(rows)
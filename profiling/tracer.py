@@ -0,0 +1,119 @@
+"""Define pipeline tracer classes."""
+import heapq
+import itertools
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Tracer(object):
+    """Record the wall time of each pipeline step into a trace file.
+
+    The trace is JSON lines: one event per timed step of a document or
+    sentence, then a summary with the total time of each step and the
+    slowest documents, broken down by step. Documents are numbered by
+    their row within their input file, so events and slowest documents
+    also name the input file being labeled.
+    """
+
+    def __init__(self, trace_path, slowest=10):
+        self.trace_file = open(trace_path, "w")
+        self.slowest = slowest
+        self.step_counts = defaultdict(int)
+        self.step_seconds = defaultdict(float)
+        # Step times of the documents seen since the last flush.
+        self.document_steps = defaultdict(lambda: defaultdict(float))
+        # Min-heap of (seconds, order, input, document, steps) for the
+        # slowest documents; the order breaks ties between equal times.
+        self.slowest_documents = []
+        self.order = itertools.count()
+        # Input file of the documents traced.
+        self.input = None
+
+    def set_input(self, input_path):
+        """Attribute the documents traced from now on to an input file."""
+        self.flush()
+        self.input = str(input_path)
+
+    @contextmanager
+    def span(self, step, document, sentence=None, **fields):
+        """Time the enclosed block as one step of a document."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(step, time.perf_counter() - start, document,
+                        sentence, **fields)
+
+    def record(self, step, seconds, document, sentence=None, **fields):
+        """Record a step measured by the caller."""
+        self.step_counts[step] += 1
+        self.step_seconds[step] += seconds
+        self.document_steps[self.input, document][step] += seconds
+        event = {"step": step, "input": self.input, "document": document,
+                 "sentence": sentence, "seconds": seconds}
+        event.update(fields)
+        self.trace_file.write(json.dumps(event) + "\n")
+
+    def flush(self):
+        """Rank the documents traced so far, once all their steps ran."""
+        for (input_path, document), steps in self.document_steps.items():
+            entry = (sum(steps.values()), next(self.order), input_path,
+                     document, dict(steps))
+            if len(self.slowest_documents) < self.slowest:
+                heapq.heappush(self.slowest_documents, entry)
+            elif entry > self.slowest_documents[0]:
+                heapq.heapreplace(self.slowest_documents, entry)
+        self.document_steps.clear()
+        self.trace_file.flush()
+
+    def close(self):
+        """Write the summary and close the trace file."""
+        self.flush()
+        steps = {step: {"count": self.step_counts[step],
+                        "seconds": self.step_seconds[step]}
+                 for step in self.step_counts}
+        slowest = [{"input": input_path, "document": document,
+                    "seconds": seconds, "steps": document_steps}
+                   for seconds, _, input_path, document, document_steps
+                   in sorted(self.slowest_documents, reverse=True)]
+        summary = {"summary": {"steps": steps, "slowest": slowest}}
+        self.trace_file.write(json.dumps(summary) + "\n")
+        self.trace_file.close()
+
+
+class NullSpan(object):
+    """Context manager doing nothing, shared by every untraced step."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class NullTracer(object):
+    """Tracer that records nothing, used when tracing is off."""
+
+    def span(self, step, document, sentence=None, **fields):
+        # Spans wrap every sentence, so no generator is set up for them.
+        return NULL_SPAN
+
+    def set_input(self, input_path):
+        pass
+
+    def record(self, step, seconds, document, sentence=None, **fields):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_TRACER = NullTracer()
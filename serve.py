@@ -0,0 +1,251 @@
+"""Entry-point script to serve report labels over HTTP."""
+import asyncio
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from args import ServerArgParser
+from label import prep_objects, run_stages
+from loader import Loader
+from constants import *
+
+# Largest request body accepted, in bytes.
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+# Report labeled at startup, so the first request does not load models.
+WARMUP_REPORT = "No acute cardiopulmonary process."
+
+# The loop of the running coroutine; Python 3.6 only has get_event_loop,
+# which returns the running loop when called from a coroutine.
+get_running_loop = getattr(asyncio, "get_running_loop",
+                           asyncio.get_event_loop)
+
+
+def run(coroutine):
+    """Run a coroutine in a new event loop until it completes."""
+    if hasattr(asyncio, "run"):
+        return asyncio.run(coroutine)
+    # asyncio.run is only available from Python 3.7.
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class LabelServer(object):
+    """Label reports sent over HTTP with warm pipeline objects.
+
+    Clients POST {"reports": [...]} (or {"report": "..."}) to /label and
+    get back one vector of CATEGORIES labels per report, with null for
+    unmentioned categories. Requests arriving within the batch window are
+    labeled together as one collection; if that fails, each request is
+    labeled on its own, so only the failing request gets an error.
+    """
+
+    def __init__(self, args):
+        # The pipeline objects are not thread-safe, and the parse cache
+        # connection may only be used by the thread that opened it, so
+        # one thread creates and runs them.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.loader = Loader(None, args.extract_impression,
+                             impression_rules=args.impression_rules,
+                             missing_impression=args.missing_impression)
+        self.extractor, self.classifier, self.aggregator\
+            = self.executor.submit(prep_objects, args).result()
+        self.batch_window = args.batch_window / 1000
+        self.max_batch_size = args.max_batch_size
+        self.verbose = args.verbose
+        self.queue = None
+
+    def label_reports(self, reports):
+        """Label a list of reports."""
+        self.loader.load_reports(reports)
+        self.loader.prep_collection()
+        labels = run_stages(self.loader.collection,
+                            self.extractor, self.classifier, self.aggregator)
+        return self.loader.expand(labels)
+
+    async def label(self, reports):
+        """Queue reports for the next batch and wait for their labels."""
+        future = get_running_loop().create_future()
+        await self.queue.put((reports, future))
+        return await future
+
+    async def run_batches(self):
+        """Label the queued reports, batching requests that arrive close
+        together."""
+        loop = get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            batch_size = len(batch[0][0])
+            deadline = loop.time() + self.batch_window
+            while batch_size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(),
+                                                     timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                batch_size += len(request[0])
+
+            reports = [report for request_reports, _ in batch
+                       for report in request_reports]
+            if self.verbose:
+                print(f"Labeling {len(reports)} reports from "
+                      f"{len(batch)} requests.")
+            try:
+                labels = await loop.run_in_executor(self.executor,
+                                                    self.label_reports,
+                                                    reports)
+            except Exception as error:
+                if len(batch) == 1:
+                    if not batch[0][1].cancelled():
+                        batch[0][1].set_exception(error)
+                else:
+                    await self.label_requests(batch)
+                continue
+
+            start = 0
+            for request_reports, future in batch:
+                end = start + len(request_reports)
+                if not future.cancelled():
+                    future.set_result(labels[start:end])
+                start = end
+
+    async def label_requests(self, batch):
+        """Label each request of a failed batch on its own, so a bad
+        request fails alone."""
+        loop = get_running_loop()
+        for reports, future in batch:
+            if future.cancelled():
+                continue
+            try:
+                labels = await loop.run_in_executor(self.executor,
+                                                    self.label_reports,
+                                                    reports)
+            except Exception as error:
+                if not future.cancelled():
+                    future.set_exception(error)
+            else:
+                if not future.cancelled():
+                    future.set_result(labels)
+
+    async def respond(self, reader):
+        """Read an HTTP request and return the response status and body."""
+        request_line = await reader.readline()
+        try:
+            method, path, _ = request_line.decode("latin-1").split()
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "Malformed request."}
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if path == "/health":
+            return HTTPStatus.OK, {"status": "ok"}
+        if path != "/label":
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown path {path}."}
+        if method != "POST":
+            return (HTTPStatus.METHOD_NOT_ALLOWED,
+                    {"error": "Reports must be sent with POST."})
+
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {"error": "Bad Content-Length."}
+        if length > MAX_BODY_SIZE:
+            return (HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                    {"error": f"Requests are limited to {MAX_BODY_SIZE} "
+                              "bytes."})
+
+        try:
+            request = json.loads((await reader.readexactly(length))
+                                 .decode("utf-8"))
+            if "report" in request:
+                reports = [request["report"]]
+            else:
+                reports = request["reports"]
+        except (ValueError, TypeError, KeyError, asyncio.IncompleteReadError):
+            return (HTTPStatus.BAD_REQUEST,
+                    {"error": 'Expected a JSON object with "report" or '
+                              '"reports".'})
+        if (not isinstance(reports, list) or
+                not all(isinstance(report, str) for report in reports)):
+            return (HTTPStatus.BAD_REQUEST,
+                    {"error": "Reports must be strings."})
+        if len(reports) == 0:
+            return HTTPStatus.OK, {"categories": CATEGORIES, "labels": []}
+
+        try:
+            labels = await self.label(reports)
+        except Exception as error:
+            return (HTTPStatus.INTERNAL_SERVER_ERROR,
+                    {"error": f"Labeling failed: {error!r}"})
+
+        labels = [[None if math.isnan(label) else float(label)
+                   for label in report_labels]
+                  for report_labels in labels]
+        return HTTPStatus.OK, {"categories": CATEGORIES, "labels": labels}
+
+    async def handle(self, reader, writer):
+        """Answer one HTTP request on a connection."""
+        status, body = await self.respond(reader)
+        payload = json.dumps(body).encode("utf-8")
+        header = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                  "Content-Type: application/json\r\n"
+                  f"Content-Length: {len(payload)}\r\n"
+                  "Connection: close\r\n\r\n")
+        writer.write(header.encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def serve(self, host, port, socket_path=None):
+        """Warm up the pipeline, then answer requests until interrupted."""
+        self.executor.submit(self.label_reports, [WARMUP_REPORT]).result()
+        try:
+            run(self.listen(host, port, socket_path))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown()
+
+    async def listen(self, host, port, socket_path=None):
+        """Answer requests until cancelled."""
+        self.queue = asyncio.Queue()
+        if socket_path is None:
+            server = await asyncio.start_server(self.handle, host, port)
+            address = f"http://{host}:{port}"
+        else:
+            server = await asyncio.start_unix_server(self.handle,
+                                                     path=str(socket_path))
+            address = str(socket_path)
+        batches = asyncio.ensure_future(self.run_batches())
+        print(f"Serving labels on {address}.")
+
+        try:
+            await batches
+        finally:
+            batches.cancel()
+            server.close()
+            await server.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = ServerArgParser()
+    args = parser.parse_args()
+
+    server = LabelServer(args)
+    server.serve(args.host, args.port, args.socket_path)
@@ -3,105 +3,98 @@ import numpy as np
 from tqdm import tqdm
 
 from constants import *
+from profiling import NULL_TRACER
+
+
+# Bit recording each label among the mentions of a category.
+NEGATIVE_BIT = 1
+UNCERTAIN_BIT = 2
+POSITIVE_BIT = 4
+
+# Label of a category given the bits of its mentions. Conflicts resolve
+# negative and uncertain to uncertain, even alongside positive, and
+# otherwise to positive; unmentioned categories are NaN.
+RESOLVED_LABELS = np.array([np.nan,
+                            NEGATIVE,   # negative
+                            UNCERTAIN,  # uncertain
+                            UNCERTAIN,  # negative and uncertain
+                            POSITIVE,   # positive
+                            POSITIVE,   # negative and positive
+                            POSITIVE,   # uncertain and positive
+                            UNCERTAIN],  # all three
+                           dtype=np.float32)
 
 
 class Aggregator(object):
     """Aggregate mentions of observations from radiology reports."""
-    def __init__(self, categories, verbose=False):
+    def __init__(self, categories, verbose=False, tracer=NULL_TRACER):
         self.categories = categories
+        self.columns = {category: column
+                        for column, category in enumerate(categories)}
 
         self.verbose = verbose
+        self.tracer = tracer
+
+    def aggregate_document(self, document, mask):
+        """Record the labels mentioned for each category of a document in
+        its row of the label bit mask, in place."""
+        columns = self.columns
+        impression_passage = document.passages[0]
+        no_finding = True
+        for annotation in impression_passage.annotations:
+            category = annotation.infons[OBSERVATION]
+
+            if NEGATION in annotation.infons:
+                bit = NEGATIVE_BIT
+            elif UNCERTAINTY in annotation.infons:
+                bit = UNCERTAIN_BIT
+            else:
+                bit = POSITIVE_BIT
 
-    def dict_to_vec(self, d):
-        """
-        Convert a dictionary of the form
+            # If at least one non-support category has a uncertain or
+            # positive label, there was a finding
+            if category != SUPPORT_DEVICES and bit != NEGATIVE_BIT:
+                no_finding = False
 
-        {cardiomegaly: [1],
-         opacity: [u, 1],
-         fracture: [0]}
+            # Don't add any labels for No Finding
+            if category == NO_FINDING:
+                continue
 
-        into a vector of the form
+            # add exception for 'chf' and 'heart failure'
+            if (bit != NEGATIVE_BIT and
+                (annotation.text == 'chf' or
+                 annotation.text == 'heart failure') and
+                CARDIOMEGALY in columns):
+                mask[columns[CARDIOMEGALY]] |= UNCERTAIN_BIT
 
-        [np.nan, np.nan, 1, u, np.nan, ..., 0, np.nan]
-        """
-        vec = []
-        for category in self.categories:
-            # There was a mention of the category.
-            if category in d:
-                label_list = d[category]
-                # Only one label, no conflicts.
-                if len(label_list) == 1:
-                    vec.append(label_list[0])
-                # Multiple labels.
-                else:
-                    # Case 1. There is negated and uncertain.
-                    if NEGATIVE in label_list and UNCERTAIN in label_list:
-                        vec.append(UNCERTAIN)
-                    # Case 2. There is negated and positive.
-                    elif NEGATIVE in label_list and POSITIVE in label_list:
-                        vec.append(POSITIVE)
-                    # Case 3. There is uncertain and positive.
-                    elif UNCERTAIN in label_list and POSITIVE in label_list:
-                        vec.append(POSITIVE)
-                    # Case 4. All labels are the same.
-                    else:
-                        vec.append(label_list[0])
-
-            # No mention of the category
-            else:
-                vec.append(np.nan)
+            if category in columns:
+                mask[columns[category]] |= bit
 
-        return vec
+        if no_finding and NO_FINDING in columns:
+            mask[columns[NO_FINDING]] = POSITIVE_BIT
 
     def aggregate(self, collection):
-        labels = []
+        """Aggregate the mentions of each document into its labels.
+
+        Return:
+            np.ndarray: float32 matrix with one row per document and one
+            column per category, NaN where a category is not mentioned.
+            It can be handed to pandas or Arrow without copying.
+        """
         documents = collection.documents
+        n_documents = len(documents)
         if self.verbose:
             print("Aggregating mentions...")
             documents = tqdm(documents)
-        for document in documents:
-            label_dict = {}
-            impression_passage = document.passages[0]
-            no_finding = True
-            for annotation in impression_passage.annotations:
-                category = annotation.infons[OBSERVATION]
-
-                if NEGATION in annotation.infons:
-                    label = NEGATIVE
-                elif UNCERTAINTY in annotation.infons:
-                    label = UNCERTAIN
-                else:
-                    label = POSITIVE
-
-                # If at least one non-support category has a uncertain or
-                # positive label, there was a finding
-                if (category != SUPPORT_DEVICES and
-                    label in [UNCERTAIN, POSITIVE]):
-                    no_finding = False
-
-                # Don't add any labels for No Finding
-                if category == NO_FINDING:
-                    continue
-
-                # add exception for 'chf' and 'heart failure'
-                if ((label in [UNCERTAIN, POSITIVE]) and
-                    (annotation.text == 'chf' or
-                     annotation.text == 'heart failure')):
-                    if CARDIOMEGALY not in label_dict:
-                        label_dict[CARDIOMEGALY] = [UNCERTAIN]
-                    else:
-                        label_dict[CARDIOMEGALY].append(UNCERTAIN)
-
-                if category not in label_dict:
-                    label_dict[category] = [label]
-                else:
-                    label_dict[category].append(label)
-
-            if no_finding:
-                label_dict[NO_FINDING] = [POSITIVE]
-
-            label_vec = self.dict_to_vec(label_dict)
-
-            labels.append(label_vec)
-
-        return np.array(labels)
+        return self.aggregate_documents(documents, n_documents)
+
+    def aggregate_documents(self, documents, n_documents):
+        """Aggregate documents as they come from an iterable of
+        n_documents, such as a generator releasing each one afterwards."""
+        masks = np.zeros((n_documents, len(self.categories)),
+                         dtype=np.int8)
+        for mask, document in zip(masks, documents):
+            with self.tracer.span("aggregate", document.id):
+                self.aggregate_document(document, mask)
+
+        return RESOLVED_LABELS[masks]
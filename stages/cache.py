@@ -0,0 +1,139 @@
+"""Define sentence cache classes."""
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+
+import bioc
+
+
+class ParseCache(object):
+    """Persistent cache of sentence parses keyed by sentence text.
+
+    Stores the parse tree and universal dependency graph of each sentence
+    in an SQLite database, so repeated sentences and re-runs over the same
+    reports skip parsing. Sentences are keyed on their exact text, which
+    Loader.clean has already normalized, and on the parsing model.
+    """
+
+    filename = "parses.sqlite"
+
+    def __init__(self, cache_dir, model_id):
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.model_id = model_id
+
+        # Worker processes share the database: WAL lets them read while
+        # one writes, and each write is committed at once, so writers only
+        # wait for each other briefly.
+        self.connection = sqlite3.connect(str(cache_dir / self.filename),
+                                          timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS parses "
+                                "(key TEXT PRIMARY KEY, tree TEXT, "
+                                "graph TEXT)")
+        self.connection.commit()
+
+    def key(self, text):
+        """Return the content address of a sentence."""
+        content = f"{self.model_id}\n{text}".encode("utf-8")
+        return hashlib.sha1(content).hexdigest()
+
+    def load(self, sentence):
+        """Add the cached parse of a sentence in place.
+
+        Return:
+            True if the sentence was found in the cache.
+        """
+        row = self.connection.execute(
+            "SELECT tree, graph FROM parses WHERE key = ?",
+            (self.key(sentence.text),)).fetchone()
+        if row is None:
+            return False
+
+        tree, graph = row
+        sentence.infons["parse tree"] = tree
+        if graph is not None:
+            annotations, relations = json.loads(graph)
+            for ann_id, infons, text, locations in annotations:
+                annotation = bioc.BioCAnnotation()
+                annotation.id = ann_id
+                annotation.infons = infons
+                annotation.text = text
+                for offset, length in locations:
+                    annotation.add_location(
+                        bioc.BioCLocation(sentence.offset + offset, length))
+                sentence.annotations.append(annotation)
+            for rel_id, infons, nodes in relations:
+                relation = bioc.BioCRelation()
+                relation.id = rel_id
+                relation.infons = infons
+                for refid, role in nodes:
+                    relation.add_node(bioc.BioCNode(refid, role))
+                sentence.relations.append(relation)
+
+        return True
+
+    def store(self, sentence):
+        """Store the parse of a sentence, with offsets made relative."""
+        tree = sentence.infons.get("parse tree")
+        graph = None
+        if sentence.annotations or sentence.relations:
+            annotations = [[annotation.id,
+                            annotation.infons,
+                            annotation.text,
+                            [[location.offset - sentence.offset,
+                              location.length]
+                             for location in annotation.locations]]
+                           for annotation in sentence.annotations]
+            relations = [[relation.id,
+                          relation.infons,
+                          [[node.refid, node.role]
+                           for node in relation.nodes]]
+                         for relation in sentence.relations]
+            graph = json.dumps([annotations, relations])
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO parses VALUES (?, ?, ?)",
+            (self.key(sentence.text), tree, graph))
+
+    def store_all(self, sentences):
+        """Store the parses of sentences in a single transaction.
+
+        The transaction is committed before returning, so the write lock
+        is not held while more sentences are parsed.
+        """
+        with self.connection:
+            for sentence in sentences:
+                self.store(sentence)
+
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entry.
+
+    Counts the hits and misses of every lookup.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the value stored for key, or None."""
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        """Store a value, evicting the oldest entry when full."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
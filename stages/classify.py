@@ -1,26 +1,104 @@
 """Define mention classifier class."""
 import logging
+import time
 from pathlib import Path
+import bioc
 from negbio.pipeline import parse, ptb2ud, negdetect
 from negbio.neg import semgraph, propagator, neg_detector
 from negbio import ngrex
 from tqdm import tqdm
 
 from constants import *
+from profiling import NULL_TRACER
+from .cache import LRUCache, ParseCache
+from .prefilter import LemmaPrefilter
+
+
+# Families of negation and uncertainty rules, in matching order.
+PRE_NEGATION_UNCERTAINTY = "pre_negation_uncertainty"
+POST_NEGATION_UNCERTAINTY = "post_negation_uncertainty"
+
+
+def load_patterns(path):
+    """Load ngrex patterns as ngrex.load does, keeping their source.
+
+    Return:
+        (list, list): compiled patterns, and the (path, line, text) each
+        pattern was read from
+    """
+    patterns = []
+    sources = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            patterns.append(ngrex.compile(line))
+            sources.append((path, line_number, line))
+    return patterns, sources
+
+
+class RecalledMatch(object):
+    """Match of a decision recalled from the sentence cache.
+
+    Keeps only the pattern, which negdetect logs, so cached decisions do
+    not keep the dependency graph of their sentence alive.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
 
 
 class ModifiedDetector(neg_detector.Detector):
     """Child class of NegBio Detector class.
 
-    Overrides parent methods __init__, detect, and match_uncertainty.
+    Overrides parent methods __init__, detect, match_neg and
+    match_uncertainty.
     """
 
     def __init__(self, pre_negation_uncertainty_path,
-                 negation_path, post_negation_uncertainty_path):
-        self.neg_patterns = ngrex.load(negation_path)
-        self.uncertain_patterns = ngrex.load(post_negation_uncertainty_path)
-        self.preneg_uncertain_patterns\
-            = ngrex.load(pre_negation_uncertainty_path)
+                 negation_path, post_negation_uncertainty_path,
+                 rule_stats=None):
+        self.neg_patterns, neg_sources = load_patterns(negation_path)
+        self.uncertain_patterns, uncertain_sources\
+            = load_patterns(post_negation_uncertainty_path)
+        self.preneg_uncertain_patterns, preneg_uncertain_sources\
+            = load_patterns(pre_negation_uncertainty_path)
+
+        families = {PRE_NEGATION_UNCERTAINTY: preneg_uncertain_sources,
+                    NEGATION: neg_sources,
+                    POST_NEGATION_UNCERTAINTY: uncertain_sources}
+
+        # Rules are only tried on graphs with the lemmas they need.
+        self.prefilter = LemmaPrefilter()
+        for family, sources in families.items():
+            self.prefilter.add_rules(family, sources)
+
+        # Optional evaluation counts and cost of each rule.
+        self.rule_stats = rule_stats
+        if rule_stats is not None:
+            for family, sources in families.items():
+                rule_stats.add_rules(family, sources)
+
+        # Decisions of earlier sentences, managed by the Classifier.
+        self.sentence_cache = None
+        self.recalled = {}
+
+        # Time spent in each pattern family, traced per sentence.
+        self.tracer = NULL_TRACER
+        self.document_id = None
+
+    def sentence_spans(self, sentence, locs):
+        """Return the mention spans inside a sentence, relative to it."""
+        begin = sentence.offset
+        end = sentence.offset + len(sentence.text)
+        spans = {(loc[0] - begin, loc[1] - begin)
+                 for loc in locs if loc[0] < end and loc[1] > begin}
+        return tuple(sorted(spans))
+
+    def sentence_key(self, sentence, locs):
+        """Key a sentence by its text and the mention spans inside it."""
+        return sentence.text, self.sentence_spans(sentence, locs)
 
     def detect(self, sentence, locs):
         """Detect rules in report sentences.
@@ -33,6 +111,33 @@ class ModifiedDetector(neg_detector.Detector):
             (str, MatcherObj, (begin, end)): negation or uncertainty,
             matcher, matched annotation
         """
+        # Sentences without mentions are left unparsed by the Classifier.
+        if not self.sentence_spans(sentence, locs):
+            return
+
+        if self.sentence_cache is None:
+            yield from self.detect_sentence(sentence, locs)
+            return
+
+        decisions = self.recalled.get(id(sentence))
+        if decisions is None:
+            detected = list(self.detect_sentence(sentence, locs))
+            # Decisions are stored with spans relative to the sentence,
+            # and without the match, which holds the whole graph.
+            self.sentence_cache.put(
+                self.sentence_key(sentence, locs),
+                [(name, RecalledMatch(matcher.pattern),
+                  (loc[0] - sentence.offset, loc[1] - sentence.offset))
+                 for name, matcher, loc in detected])
+            yield from detected
+            return
+
+        for name, matcher, (begin, end) in decisions:
+            yield name, matcher, (sentence.offset + begin,
+                                  sentence.offset + end)
+
+    def detect_sentence(self, sentence, locs):
+        """Detect rules in a sentence from its dependency graph."""
         logger = logging.getLogger(__name__)
 
         try:
@@ -43,53 +148,205 @@ class ModifiedDetector(neg_detector.Detector):
                              f'[offset={sentence.offset}]')
             raise
         else:
-            for loc in locs:
-                for node in neg_detector.find_nodes(g, loc[0], loc[1]):
-                    # Match pre-negation uncertainty rules first.
-                    preneg_m = self.match_prenegation_uncertainty(g, node)
-                    if preneg_m:
-                        yield UNCERTAINTY, preneg_m, loc
-                    else:
-                        # Then match negation rules.
-                        neg_m = self.match_neg(g, node)
-                        if neg_m:
-                            yield NEGATION, neg_m, loc
-                        else:
-                            # Finally match post-negation uncertainty rules.
-                            postneg_m = self.match_uncertainty(g, node)
-                            if postneg_m:
-                                yield UNCERTAINTY, postneg_m, loc
+            loc_nodes = [(loc, list(neg_detector.find_nodes(g, loc[0],
+                                                            loc[1])))
+                         for loc in locs]
+            nodes = {node for _, found in loc_nodes for node in found}
+            # Lemmas present in the graph, looked up once for all families.
+            satisfied = self.prefilter.satisfied(g)
 
-    def match_uncertainty(self, graph, node):
-        for pattern in self.uncertain_patterns:
+            # Each family is matched once over the whole graph, only for
+            # the mention nodes no earlier family matched.
+            # Match pre-negation uncertainty rules first.
+            preneg_ms = self.match_family(
+                PRE_NEGATION_UNCERTAINTY, self.index_prenegation_uncertainty,
+                g, nodes, sentence, satisfied)
+            # Then match negation rules.
+            nodes -= preneg_ms.keys()
+            neg_ms = self.match_family(NEGATION, self.index_neg,
+                                       g, nodes, sentence, satisfied)
+            # Finally match post-negation uncertainty rules.
+            nodes -= neg_ms.keys()
+            postneg_ms = self.match_family(
+                POST_NEGATION_UNCERTAINTY, self.index_uncertainty,
+                g, nodes, sentence, satisfied)
+
+            for loc, found in loc_nodes:
+                for node in found:
+                    if node in preneg_ms:
+                        yield UNCERTAINTY, preneg_ms[node], loc
+                    elif node in neg_ms:
+                        yield NEGATION, neg_ms[node], loc
+                    elif node in postneg_ms:
+                        yield UNCERTAINTY, postneg_ms[node], loc
+
+    def match_family(self, family, index, graph, nodes, sentence,
+                     satisfied=None):
+        """Match a family of patterns, timing it for the tracer."""
+        if not nodes:
+            return {}
+        start = time.perf_counter()
+        matches = index(graph, nodes, satisfied)
+        self.tracer.record(family, time.perf_counter() - start,
+                           self.document_id, sentence.offset)
+        return matches
+
+    def index_patterns(self, family, patterns, graph, nodes,
+                       is_excluded=None, satisfied=None):
+        """Map each of the nodes to the first match of the patterns
+        anchored at it, evaluating each pattern once over the graph.
+
+        Patterns are tried in order and stop once every node has a match,
+        so each node gets the same match as trying the patterns for it
+        alone. Patterns needing lemmas absent from the graph, given by
+        satisfied when already known, are skipped. Matches for which
+        is_excluded returns True are passed over.
+        """
+        rule_stats = self.rule_stats
+        if satisfied is None:
+            satisfied = self.prefilter.satisfied(graph)
+        candidates = self.prefilter.candidates(family, satisfied)
+        matches = {}
+        for index, pattern in enumerate(patterns):
+            if len(matches) == len(nodes):
+                break
+            if not candidates[index]:
+                if rule_stats is not None:
+                    rule_stats.skip(family, index)
+                continue
+            if rule_stats is not None:
+                start = time.perf_counter()
+            n_matches = len(matches)
             for m in pattern.finditer(graph):
                 n0 = m.group(0)
-                if n0 == node:
-                    return m
+                if (n0 in nodes and n0 not in matches and
+                        not (is_excluded and is_excluded(graph, m))):
+                    matches[n0] = m
+            if rule_stats is not None:
+                rule_stats.record(family, index,
+                                  time.perf_counter() - start,
+                                  len(matches) - n_matches)
+        return matches
+
+    def is_double_negation(self, graph, m):
+        """Check whether the negated key word is itself negated."""
+        try:
+            key = m.get("key")
+            return semgraph.has_out_edge(graph, key, ["neg"])
+        except Exception:
+            return False
+
+    def index_neg(self, graph, nodes, satisfied=None):
+        return self.index_patterns(NEGATION, self.neg_patterns, graph, nodes,
+                                   self.is_double_negation, satisfied)
+
+    def index_uncertainty(self, graph, nodes, satisfied=None):
+        return self.index_patterns(POST_NEGATION_UNCERTAINTY,
+                                   self.uncertain_patterns, graph, nodes,
+                                   satisfied=satisfied)
+
+    def index_prenegation_uncertainty(self, graph, nodes, satisfied=None):
+        return self.index_patterns(PRE_NEGATION_UNCERTAINTY,
+                                   self.preneg_uncertain_patterns,
+                                   graph, nodes, satisfied=satisfied)
+
+    def match_neg(self, graph, node):
+        return self.index_neg(graph, {node}).get(node)
+
+    def match_uncertainty(self, graph, node):
+        return self.index_uncertainty(graph, {node}).get(node)
 
     def match_prenegation_uncertainty(self, graph, node):
-        for pattern in self.preneg_uncertain_patterns:
-            for m in pattern.finditer(graph):
-                n0 = m.group(0)
-                if n0 == node:
-                    return m
+        return self.index_prenegation_uncertainty(graph, {node}).get(node)
 
 
 class Classifier(object):
     """Classify mentions of observations from radiology reports."""
 
     def __init__(self, pre_negation_uncertainty_path, negation_path,
-                 post_negation_uncertainty_path, verbose=False):
+                 post_negation_uncertainty_path, parse_cache_dir=None,
+                 sentence_cache_size=0, verbose=False, tracer=NULL_TRACER,
+                 rule_stats=None):
         self.parser = parse.NegBioParser(model_dir=PARSING_MODEL_DIR)
         self.lemmatizer = ptb2ud.Lemmatizer()
         self.ptb2dep = ptb2ud.NegBioPtb2DepConverter(
             self.lemmatizer, universal=True)
 
+        self.parse_cache = None
+        if parse_cache_dir is not None:
+            self.parse_cache = ParseCache(parse_cache_dir,
+                                          PARSING_MODEL_DIR.name)
+
         self.verbose = verbose
+        self.tracer = tracer
 
         self.detector = ModifiedDetector(pre_negation_uncertainty_path,
                                          negation_path,
-                                         post_negation_uncertainty_path)
+                                         post_negation_uncertainty_path,
+                                         rule_stats)
+        self.detector.tracer = tracer
+        if sentence_cache_size > 0:
+            self.detector.sentence_cache = LRUCache(sentence_cache_size)
+
+    def mention_locs(self, document):
+        """Return the (begin, end) span of each mention of a document."""
+        locs = []
+        for annotation in document.passages[0].annotations:
+            total_loc = annotation.get_total_location()
+            locs.append((total_loc.offset,
+                         total_loc.offset + total_loc.length))
+        return locs
+
+    def mentioned_sentences(self, document, locs):
+        """Return the sentences of a document containing a mention."""
+        return [sentence for sentence in document.passages[0].sentences
+                if self.detector.sentence_spans(sentence, locs)]
+
+    def recall(self, sentences, locs):
+        """Look up the cached decisions for sentences.
+
+        Return:
+            (dict, list): detector decisions keyed by the id of each
+            recalled sentence, and the sentences that still need parsing.
+        """
+        recalled = {}
+        pending = []
+        for sentence in sentences:
+            key = self.detector.sentence_key(sentence, locs)
+            decisions = self.detector.sentence_cache.get(key)
+            if decisions is None:
+                pending.append(sentence)
+            else:
+                recalled[id(sentence)] = decisions
+
+        return recalled, pending
+
+    def parse_sentences(self, document, sentences):
+        """Parse sentences of a document and add their universal
+        dependency graphs in place."""
+        # Sentences are parsed one at a time so each can be traced.
+        for sentence in sentences:
+            passage = bioc.BioCPassage()
+            passage.offset = document.passages[0].offset
+            passage.sentences = [sentence]
+            pending = bioc.BioCDocument()
+            pending.id = document.id
+            pending.add_passage(passage)
+            with self.tracer.span("parse", document.id, sentence.offset):
+                self.parser.parse_doc(pending)
+            with self.tracer.span("convert", document.id, sentence.offset):
+                self.ptb2dep.convert_doc(pending)
+
+    def parse(self, document, sentences):
+        """Parse sentences of the impression and add their universal
+        dependency graphs in place, reusing cached parses where available."""
+        if self.parse_cache is not None:
+            sentences = [sentence for sentence in sentences
+                         if not self.parse_cache.load(sentence)]
+        if sentences:
+            self.parse_sentences(document, sentences)
+        if self.parse_cache is not None:
+            self.parse_cache.store_all(sentences)
 
     def classify(self, collection):
         """Classify each mention into one of
@@ -99,11 +356,31 @@ class Classifier(object):
             print("Classifying mentions...")
             documents = tqdm(documents)
         for document in documents:
-            # Parse the impression text in place.
-            self.parser.parse_doc(document)
-            # Add the universal dependency graph in place.
-            self.ptb2dep.convert_doc(document)
-            # Detect the negation and uncertainty rules in place.
+            self.classify_document(document)
+        self.finish()
+
+    def classify_document(self, document):
+        """Classify the mentions of one report in place."""
+        # Only sentences with mentions are parsed and matched.
+        locs = self.mention_locs(document)
+        sentences = self.mentioned_sentences(document, locs)
+        # Sentences already seen with the same mentions need no parse.
+        if self.detector.sentence_cache is not None:
+            self.detector.recalled, sentences = self.recall(sentences, locs)
+        # Parse the impression text and add the universal dependency
+        # graph in place.
+        self.parse(document, sentences)
+        # Detect the negation and uncertainty rules in place.
+        self.detector.document_id = document.id
+        with self.tracer.span("detect", document.id):
             negdetect.detect(document, self.detector)
-            # To reduce memory consumption, remove sentences text.
-            del document.passages[0].sentences[:]
+        # To reduce memory consumption, remove sentences text.
+        del document.passages[0].sentences[:]
+
+    def finish(self):
+        """Report the use of the sentence cache by classify_document
+        calls."""
+        sentence_cache = self.detector.sentence_cache
+        if self.verbose and sentence_cache is not None:
+            print(f"Sentence cache: {sentence_cache.hits} hits, "
+                  f"{sentence_cache.misses} misses.")
@@ -1,23 +1,95 @@
 """Define observation extractor class."""
 import re
+import bisect
 import itertools
 from collections import defaultdict
 from tqdm import tqdm
 from constants import *
+from profiling import NULL_TRACER
 
 import bioc
 
 
+# Characters that give a phrase regex meaning beyond its literal text.
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+
+class PhraseMatcher(object):
+    """Find the matches of many phrases in a sentence with one scan.
+
+    Produces the same matches as calling re.finditer on every phrase in
+    turn. Literal phrases are stored in a trie, which is walked only at the
+    positions where a single combined regex says some phrase starts.
+    Phrases using regex syntax keep their own compiled pattern.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+        self.trie = {}
+        self.patterns = []
+        for index, phrase in enumerate(self.phrases):
+            if phrase and not REGEX_METACHARACTERS.intersection(phrase):
+                node = self.trie
+                for char in phrase:
+                    node = node.setdefault(char, {})
+                # The None key holds the indices of phrases ending here.
+                node.setdefault(None, []).append(index)
+            else:
+                self.patterns.append((index, re.compile(phrase)))
+
+        self.starts = None
+        if self.trie:
+            self.starts = re.compile(f"(?={self.trie_to_regex(self.trie)})")
+
+    def trie_to_regex(self, node):
+        """Build a regex matching any phrase prefix stored below node."""
+        if None in node:
+            # A phrase ends here, so its prefix is enough to mark a start.
+            return ""
+        branches = [re.escape(char) + self.trie_to_regex(child)
+                    for char, child in sorted(node.items())]
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    def findall(self, text):
+        """Return sorted (phrase index, start, end) tuples for text."""
+        matches = []
+        if self.starts is not None:
+            # re.finditer never returns overlapping matches of one phrase.
+            last_end = {}
+            for candidate in self.starts.finditer(text):
+                start = candidate.start()
+                node = self.trie
+                for end in range(start, len(text)):
+                    node = node.get(text[end])
+                    if node is None:
+                        break
+                    for index in node.get(None, ()):
+                        if start >= last_end.get(index, 0):
+                            last_end[index] = end + 1
+                            matches.append((index, start, end + 1))
+
+        for index, pattern in self.patterns:
+            for match in pattern.finditer(text):
+                matches.append((index,) + match.span(0))
+
+        matches.sort()
+        return matches
+
+
 class Extractor(object):
     """Extract observations from impression sections of reports."""
     def __init__(self, mention_phrases_dir, unmention_phrases_dir,
-                 verbose=False):
+                 verbose=False, tracer=NULL_TRACER):
         self.verbose = verbose
+        self.tracer = tracer
         self.observation2mention_phrases\
             = self.load_phrases(mention_phrases_dir, "mention")
         self.observation2unmention_phrases\
             = self.load_phrases(unmention_phrases_dir, "unmention")
         self.add_unmention_phrases()
+        self.build_matchers()
 
     def load_phrases(self, phrases_dir, phrases_type):
         """Read in map from observations to phrases for matching."""
@@ -61,22 +133,52 @@ class Extractor(object):
         self.observation2unmention_phrases[ENLARGED_CARDIOMEDIASTINUM]\
             = enlarged_cardiomediastinum_unmentions
 
-    def overlaps_with_unmention(self, sentence, observation, start, end):
+    def build_matchers(self):
+        """Compile the mention and unmention phrases into matchers."""
+        self.mentions = [(observation, phrase)
+                         for observation, phrases
+                         in self.observation2mention_phrases.items()
+                         for phrase in phrases]
+        self.mention_matcher\
+            = PhraseMatcher(phrase for _, phrase in self.mentions)
+        self.unmentions = [(observation, phrase)
+                           for observation, phrases
+                           in self.observation2unmention_phrases.items()
+                           for phrase in phrases]
+        self.unmention_matcher\
+            = PhraseMatcher(phrase for _, phrase in self.unmentions)
+
+    def index_unmentions(self, sentence):
+        """Find every unmention span of a sentence, keyed by observation.
+
+        Each observation maps to its sorted span starts together with the
+        furthest span end reached by the spans up to each start.
+        """
+        observation2spans = defaultdict(list)
+        matches = self.unmention_matcher.findall(sentence.text)
+        for unmention_index, start, end in matches:
+            observation = self.unmentions[unmention_index][0]
+            observation2spans[observation].append((start, end))
+
+        unmention_spans = {}
+        for observation, spans in observation2spans.items():
+            spans.sort()
+            starts = [start for start, _ in spans]
+            reach = list(itertools.accumulate((end for _, end in spans), max))
+            unmention_spans[observation] = (starts, reach)
+
+        return unmention_spans
+
+    def overlaps_with_unmention(self, unmention_spans, observation,
+                                start, end):
         """Return True if a given match overlaps with an unmention phrase."""
-        unmention_overlap = False
-        unmention_list = self.observation2unmention_phrases.get(observation,
-                                                                [])
-        for unmention in unmention_list:
-            unmention_matches = re.finditer(unmention, sentence.text)
-            for unmention_match in unmention_matches:
-                unmention_start, unmention_end = unmention_match.span(0)
-                if start < unmention_end and end > unmention_start:
-                    unmention_overlap = True
-                    break  # break early if overlap is found
-            if unmention_overlap:
-                break  # break early if overlap is found
-
-        return unmention_overlap
+        if observation not in unmention_spans:
+            return False
+
+        starts, reach = unmention_spans[observation]
+        # Only unmentions starting before the match ends can overlap it.
+        count = bisect.bisect_left(starts, end)
+        return count > 0 and reach[count - 1] > start
 
     def add_match(self, impression, sentence, ann_index, phrase,
                   observation, start, end):
@@ -113,30 +215,42 @@ class Extractor(object):
         if self.verbose:
             print("Extracting mentions...")
             documents = tqdm(documents)
-        
-        obs_phrases = self.observation2mention_phrases.items()
+
         for document in documents:
-            # Get the Impression section.
-            impression = document.passages[0]
-            annotation_index = itertools.count(len(impression.annotations))
-
-            for sentence in impression.sentences:
-                for observation, phrases in obs_phrases:
-                    for phrase in phrases:
-                        matches = re.finditer(phrase, sentence.text)
-                        for match in matches:
-                            start, end = match.span(0)
-
-                            if self.overlaps_with_unmention(sentence,
-                                                            observation,
-                                                            start,
-                                                            end):
-                                continue
-
-                            self.add_match(impression,
-                                           sentence,
-                                           str(next(annotation_index)),
-                                           phrase,
-                                           observation,
-                                           start,
-                                           end)
+            self.extract_document(document)
+
+    def extract_document(self, document):
+        """Extract the observations in one report in place."""
+        # Get the Impression section.
+        impression = document.passages[0]
+        annotation_index = itertools.count(len(impression.annotations))
+
+        for sentence in impression.sentences:
+            with self.tracer.span("match_phrases", document.id,
+                                  sentence.offset):
+                self.extract_sentence(impression, sentence,
+                                      annotation_index)
+
+    def extract_sentence(self, impression, sentence, annotation_index):
+        """Add the observations mentioned in a sentence to the impression
+        in place."""
+        # Matches come back ordered by observation, then phrase.
+        matches = self.mention_matcher.findall(sentence.text)
+        if matches:
+            unmention_spans = self.index_unmentions(sentence)
+        for mention_index, start, end in matches:
+            observation, phrase = self.mentions[mention_index]
+
+            if self.overlaps_with_unmention(unmention_spans,
+                                            observation,
+                                            start,
+                                            end):
+                continue
+
+            self.add_match(impression,
+                           sentence,
+                           str(next(annotation_index)),
+                           phrase,
+                           observation,
+                           start,
+                           end)
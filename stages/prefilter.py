@@ -0,0 +1,75 @@
+"""Define rule prefilter class."""
+import re
+
+# Lemma constraint of an ngrex node, e.g. {lemma:/stable|unchanged/}.
+LEMMA_CONSTRAINT = re.compile(r"lemma:/((?:[^/\\]|\\.)*)/")
+# Regular expressions of any node constraint.
+CONSTRAINT_REGEX = re.compile(r"/(?:[^/\\]|\\.)*/")
+# Operators making a node constraint optional or negated.
+OPTIONAL_OPERATORS = set("|!?")
+
+
+def required_lemmas(pattern_text):
+    """Return the lemma regular expressions a rule needs in the graph.
+
+    Every node of a conjunctive rule must match some node of the graph, so
+    each of its lemma constraints must match some lemma. Rules using
+    alternation, negation or optional relations need nothing.
+    """
+    if OPTIONAL_OPERATORS & set(CONSTRAINT_REGEX.sub("", pattern_text)):
+        return []
+    return LEMMA_CONSTRAINT.findall(pattern_text)
+
+
+class LemmaPrefilter(object):
+    """Skip rules whose required lemmas are absent from a sentence graph.
+
+    Each lemma seen is indexed, once, to the lemma constraints it could
+    satisfy; a rule is a candidate when all of its constraints are
+    satisfied by some lemma of the graph. Constraints are searched
+    case-insensitively anywhere in the lemma, so a rule that could match
+    is never skipped.
+    """
+
+    def __init__(self):
+        self.regexes = []
+        self.regex_ids = {}
+        # Rule family -> frozenset of the constraint ids of each rule.
+        self.requirements = {}
+        # Lemma -> frozenset of the constraint ids it satisfies.
+        self.lemma_index = {}
+
+    def add_rules(self, family, sources):
+        """Index the lemma constraints of the (path, line, text) rules."""
+        requirements = []
+        for _, _, pattern_text in sources:
+            ids = set()
+            for regex in required_lemmas(pattern_text):
+                if regex not in self.regex_ids:
+                    self.regex_ids[regex] = len(self.regexes)
+                    self.regexes.append(re.compile(regex, re.IGNORECASE))
+                ids.add(self.regex_ids[regex])
+            requirements.append(frozenset(ids))
+        self.requirements[family] = requirements
+        # Lemmas indexed so far have not been checked for new constraints.
+        self.lemma_index.clear()
+
+    def satisfied(self, graph):
+        """Return the ids of the constraints satisfied by the graph."""
+        satisfied = set()
+        for _, data in graph.nodes(data=True):
+            lemma = data.get("lemma")
+            if lemma is None:
+                continue
+            ids = self.lemma_index.get(lemma)
+            if ids is None:
+                ids = frozenset(i for i, regex in enumerate(self.regexes)
+                                if regex.search(lemma))
+                self.lemma_index[lemma] = ids
+            satisfied |= ids
+        return satisfied
+
+    def candidates(self, family, satisfied):
+        """Return whether each rule of a family could match."""
+        return [requirements <= satisfied
+                for requirements in self.requirements[family]]
@@ -0,0 +1,45 @@
+"""Generate dependency graphs for testing the negation and uncertainty
+rules."""
+import random
+import re
+from pathlib import Path
+
+import networkx as nx
+
+PATTERNS_DIR = Path(__file__).resolve().parents[1] / "patterns"
+
+# Values of one node or edge attribute constraint of a rule.
+ATTRIBUTE = re.compile(r"(lemma|tag|dependency):/((?:[^/\\]|\\.)*)/")
+PLAIN_VALUE = re.compile(r"[a-z:]+")
+TAGS = ["NN", "NNS", "JJ", "VBN", "VBZ", "DT", "IN", "RB"]
+
+
+def vocabulary():
+    """Collect the plain lemmas and dependencies the rules look for."""
+    values = {"lemma": set(), "dependency": set()}
+    for path in PATTERNS_DIR.glob("*.txt"):
+        for attribute, regex in ATTRIBUTE.findall(path.read_text()):
+            if attribute not in values:
+                continue
+            for value in regex.strip("^$").split("|"):
+                if PLAIN_VALUE.fullmatch(value):
+                    values[attribute].add(value)
+    return sorted(values["lemma"]), sorted(values["dependency"])
+
+
+def random_graphs(n_graphs, seed=0):
+    """Generate dense dependency graphs over the vocabulary of the rules."""
+    lemmas, dependencies = vocabulary()
+    lemmas += ["effusion", "pneumonia", "lung", "heart", "be", "the"]
+    rng = random.Random(seed)
+    for _ in range(n_graphs):
+        graph = nx.DiGraph()
+        n_nodes = rng.randint(2, 9)
+        for node in range(n_nodes):
+            graph.add_node(f"T{node}", lemma=rng.choice(lemmas),
+                           tag=rng.choice(TAGS))
+        for _ in range(rng.randint(1, 3 * n_nodes)):
+            governor, dependant = rng.sample(range(n_nodes), 2)
+            graph.add_edge(f"T{governor}", f"T{dependant}",
+                           dependency=rng.choice(dependencies))
+        yield graph
@@ -0,0 +1,103 @@
+"""Test label aggregation against the label lists it replaced."""
+import itertools
+import random
+
+import pytest
+
+pytest.importorskip("negbio")
+np = pytest.importorskip("numpy")
+bioc = pytest.importorskip("bioc")
+
+from constants import *  # noqa: E402,F403
+from stages.aggregate import (Aggregator, RESOLVED_LABELS,  # noqa: E402
+                              NEGATIVE_BIT, UNCERTAIN_BIT, POSITIVE_BIT)
+
+BITS = {NEGATIVE: NEGATIVE_BIT, UNCERTAIN: UNCERTAIN_BIT,
+        POSITIVE: POSITIVE_BIT}
+
+
+def resolve(label_list):
+    """Resolve the labels of a category, as dict_to_vec used to."""
+    if len(label_list) == 1:
+        return label_list[0]
+    if NEGATIVE in label_list and UNCERTAIN in label_list:
+        return UNCERTAIN
+    if NEGATIVE in label_list and POSITIVE in label_list:
+        return POSITIVE
+    if UNCERTAIN in label_list and POSITIVE in label_list:
+        return POSITIVE
+    return label_list[0]
+
+
+def old_labels(annotations, categories):
+    """Aggregate annotations, as aggregate_document used to."""
+    label_dict = {}
+    no_finding = True
+    for annotation in annotations:
+        category = annotation.infons[OBSERVATION]
+        if NEGATION in annotation.infons:
+            label = NEGATIVE
+        elif UNCERTAINTY in annotation.infons:
+            label = UNCERTAIN
+        else:
+            label = POSITIVE
+        if category != SUPPORT_DEVICES and label in [UNCERTAIN, POSITIVE]:
+            no_finding = False
+        if category == NO_FINDING:
+            continue
+        if (label in [UNCERTAIN, POSITIVE] and
+                annotation.text in ('chf', 'heart failure')):
+            label_dict.setdefault(CARDIOMEGALY, []).append(UNCERTAIN)
+        label_dict.setdefault(category, []).append(label)
+    if no_finding:
+        label_dict[NO_FINDING] = [POSITIVE]
+    return [resolve(label_dict[category]) if category in label_dict
+            else np.nan for category in categories]
+
+
+@pytest.mark.parametrize("n_mentions", [1, 2, 3, 4])
+def test_resolved_labels_match_label_lists(n_mentions):
+    for label_list in itertools.product([NEGATIVE, UNCERTAIN, POSITIVE],
+                                        repeat=n_mentions):
+        mask = 0
+        for label in label_list:
+            mask |= BITS[label]
+        assert RESOLVED_LABELS[mask] == resolve(list(label_list))
+    assert np.isnan(RESOLVED_LABELS[0])
+
+
+def random_document(rng, index):
+    document = bioc.BioCDocument()
+    document.id = str(index)
+    passage = bioc.BioCPassage()
+    for i in range(rng.randint(0, 6)):
+        annotation = bioc.BioCAnnotation()
+        annotation.id = str(i)
+        annotation.infons[OBSERVATION] = rng.choice(CATEGORIES)
+        kind = rng.choice([None, NEGATION, UNCERTAINTY])
+        if kind is not None:
+            annotation.infons[kind] = "True"
+        annotation.text = rng.choice(["chf", "heart failure", "effusion"])
+        passage.annotations.append(annotation)
+    document.add_passage(passage)
+    return document
+
+
+@pytest.mark.parametrize("categories", [
+    CATEGORIES,
+    # Categories may leave out Cardiomegaly and No Finding.
+    [c for c in CATEGORIES if c not in (CARDIOMEGALY, NO_FINDING)],
+])
+def test_aggregate_matches_label_lists(categories):
+    rng = random.Random(0)
+    documents = [random_document(rng, i) for i in range(500)]
+    expected = [old_labels(document.passages[0].annotations, categories)
+                for document in documents]
+
+    collection = bioc.BioCCollection()
+    for document in documents:
+        collection.add_document(document)
+    labels = Aggregator(categories).aggregate(collection)
+
+    assert labels.dtype == np.float32
+    np.testing.assert_array_equal(labels, np.array(expected))
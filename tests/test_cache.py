@@ -0,0 +1,185 @@
+"""Test the sentence parse and decision caches."""
+import sqlite3
+
+import pytest
+
+pytest.importorskip("negbio")
+pytest.importorskip("networkx")
+bioc = pytest.importorskip("bioc")
+
+from constants import NEGATION, UNCERTAINTY  # noqa: E402
+from rule_graphs import PATTERNS_DIR  # noqa: E402
+from stages.cache import LRUCache, ParseCache  # noqa: E402
+from stages.classify import ModifiedDetector, RecalledMatch  # noqa: E402
+
+TEXT = "no pleural effusion ."
+TREE = "(S1 (NP (DT no) (JJ pleural) (NN effusion)))"
+
+
+def parsed_sentence(offset, text=TEXT):
+    """Return a sentence with a parse tree and a dependency graph."""
+    sentence = bioc.BioCSentence()
+    sentence.offset = offset
+    sentence.text = text
+    sentence.infons["parse tree"] = TREE
+    for ann_id, start, word in (("T0", 0, "no"), ("T1", 3, "pleural"),
+                                ("T2", 11, "effusion")):
+        annotation = bioc.BioCAnnotation()
+        annotation.id = ann_id
+        annotation.infons = {"tag": "NN", "lemma": word}
+        annotation.text = word
+        annotation.add_location(bioc.BioCLocation(offset + start, len(word)))
+        sentence.annotations.append(annotation)
+    relation = bioc.BioCRelation()
+    relation.id = "R0"
+    relation.infons = {"dependency": "neg"}
+    relation.add_node(bioc.BioCNode("T0", "dependant"))
+    relation.add_node(bioc.BioCNode("T2", "governor"))
+    sentence.relations.append(relation)
+    return sentence
+
+
+def graph(sentence):
+    annotations = [(a.id, a.infons, a.text,
+                    [(loc.offset, loc.length) for loc in a.locations])
+                   for a in sentence.annotations]
+    relations = [(r.id, r.infons, [(n.refid, n.role) for n in r.nodes])
+                 for r in sentence.relations]
+    return annotations, relations
+
+
+def test_load_rebases_stored_parse(tmp_path):
+    cache = ParseCache(tmp_path, "model")
+    cache.store_all([parsed_sentence(10)])
+
+    sentence = bioc.BioCSentence()
+    sentence.offset = 57
+    sentence.text = TEXT
+    assert cache.load(sentence)
+    expected = parsed_sentence(57)
+    assert sentence.infons["parse tree"] == expected.infons["parse tree"]
+    assert graph(sentence) == graph(expected)
+
+    # A later run reads the committed parse; other text or models miss.
+    sentence = bioc.BioCSentence()
+    sentence.offset = 0
+    sentence.text = TEXT
+    assert ParseCache(tmp_path, "model").load(sentence)
+    sentence.text = "no effusion ."
+    assert not cache.load(sentence)
+    sentence.text = TEXT
+    assert not ParseCache(tmp_path, "other model").load(sentence)
+
+
+def test_store_without_graph(tmp_path):
+    cache = ParseCache(tmp_path, "model")
+    stored = bioc.BioCSentence()
+    stored.offset = 4
+    stored.text = TEXT
+    stored.infons["parse tree"] = None
+    cache.store_all([stored])
+
+    sentence = bioc.BioCSentence()
+    sentence.offset = 0
+    sentence.text = TEXT
+    assert cache.load(sentence)
+    assert sentence.infons["parse tree"] is None
+    assert not sentence.annotations and not sentence.relations
+
+
+def test_workers_store_in_turn(tmp_path):
+    caches = [ParseCache(tmp_path, "model") for _ in range(2)]
+    for cache in caches:
+        # Fail at once, instead of after the timeout, if a lock is held.
+        cache.connection.execute("PRAGMA busy_timeout = 0")
+
+    for i, cache in enumerate(caches * 2):
+        try:
+            cache.store_all([parsed_sentence(0, f"sentence {i} .")])
+        except sqlite3.OperationalError as error:
+            pytest.fail(f"Write {i} waited on another worker: {error}")
+
+    sentence = bioc.BioCSentence()
+    sentence.offset = 0
+    for i in range(4):
+        sentence.text = f"sentence {i} ."
+        assert caches[i % 2].load(sentence)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    cache.put("a", 4)
+    cache.put("d", 5)
+    assert cache.get("c") is None
+    assert cache.get("a") == 4
+    assert (cache.hits, cache.misses) == (4, 2)
+
+
+class GraphMatch(object):
+    """Stand-in for an ngrex match, holding the graph of its sentence."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.graph = object()
+
+
+def sentence_at(offset, text=TEXT):
+    sentence = bioc.BioCSentence()
+    sentence.offset = offset
+    sentence.text = text
+    return sentence
+
+
+def test_decisions_replayed_at_another_offset():
+    detector = ModifiedDetector(PATTERNS_DIR / "pre_negation_uncertainty.txt",
+                                PATTERNS_DIR / "negation.txt",
+                                PATTERNS_DIR / "post_negation_uncertainty.txt")
+    detector.sentence_cache = LRUCache(8)
+    detected = []
+
+    def detect_sentence(sentence, locs):
+        detected.append(sentence.offset)
+        offset = sentence.offset
+        yield NEGATION, GraphMatch("neg rule"), (offset + 11, offset + 19)
+        yield UNCERTAINTY, GraphMatch("unc rule"), (offset + 3, offset + 10)
+
+    detector.detect_sentence = detect_sentence
+    # The same sentence twice in one document, then once with other
+    # mentions.
+    first, second, third = sentence_at(5), sentence_at(40), sentence_at(80)
+    locs = [(8, 15), (16, 24), (43, 50), (51, 59), (91, 99)]
+
+    decisions = list(detector.detect(first, locs))
+    assert [(name, loc) for name, _, loc in decisions] == \
+        [(NEGATION, (16, 24)), (UNCERTAINTY, (8, 15))]
+    assert all(isinstance(matcher, GraphMatch) for _, matcher, _ in decisions)
+
+    # Cached decisions keep the pattern, but not the match and its graph.
+    cached = detector.sentence_cache.get(detector.sentence_key(first, locs))
+    assert [(name, type(matcher), matcher.pattern, span)
+            for name, matcher, span in cached] == \
+        [(NEGATION, RecalledMatch, "neg rule", (11, 19)),
+         (UNCERTAINTY, RecalledMatch, "unc rule", (3, 10))]
+    assert not hasattr(cached[0][1], "graph")
+
+    for sentence in (second, third):
+        key = detector.sentence_key(sentence, locs)
+        recalled = detector.sentence_cache.get(key)
+        detector.recalled = {} if recalled is None else \
+            {id(sentence): recalled}
+        decisions = list(detector.detect(sentence, locs))
+        assert [(name, matcher.pattern, loc)
+                for name, matcher, loc in decisions] == \
+            [(NEGATION, "neg rule", (sentence.offset + 11,
+                                     sentence.offset + 19)),
+             (UNCERTAINTY, "unc rule", (sentence.offset + 3,
+                                        sentence.offset + 10))]
+    # Only the sentence with other mentions was matched again.
+    assert detected == [5, 80]
@@ -0,0 +1,80 @@
+"""Test resuming shards from the checkpoint manifest."""
+from checkpoint import Manifest
+from checkpoint.manifest import hash_file
+
+
+def write_shard(tmp_path, rows=5):
+    input_path = tmp_path / "shard.csv"
+    input_path.write_text("".join(f"report {i}\n" for i in range(rows)))
+    return input_path
+
+
+def label_rows(checkpoint, output_path, rows, start=0):
+    with output_path.open("a") as fp:
+        for i in range(start, rows):
+            fp.write(f"{i},1.0\n")
+    checkpoint.update(rows)
+
+
+def test_resume_truncates_rows_after_last_update(tmp_path):
+    input_path = write_shard(tmp_path)
+    output_path = tmp_path / "labeled.csv"
+    manifest = Manifest(tmp_path / "checkpoints")
+
+    checkpoint = manifest.checkpoint("shard", input_path, output_path)
+    label_rows(checkpoint, output_path, 2)
+    saved = output_path.read_bytes()
+    # Rows written, but not recorded, before an interruption.
+    with output_path.open("a") as fp:
+        fp.write("2,1.0\n3,")
+
+    checkpoint = manifest.checkpoint("shard", input_path, output_path,
+                                     resume=True)
+    assert checkpoint.rows == 2
+    assert not checkpoint.complete
+    assert output_path.read_bytes() == saved
+
+    label_rows(checkpoint, output_path, 5, start=checkpoint.rows)
+    checkpoint.finish()
+    record = manifest.load("shard")
+    assert record["rows"] == 5
+    assert record["output_size"] == output_path.stat().st_size
+    assert record["output_hash"] == hash_file(output_path).hexdigest()
+
+    checkpoint = manifest.checkpoint("shard", input_path, output_path,
+                                     resume=True)
+    assert checkpoint.complete
+    assert checkpoint.rows == 5
+
+
+def test_resume_restarts_on_mismatch(tmp_path):
+    input_path = write_shard(tmp_path)
+    output_path = tmp_path / "labeled.csv"
+    manifest = Manifest(tmp_path / "checkpoints")
+
+    checkpoint = manifest.checkpoint("shard", input_path, output_path)
+    label_rows(checkpoint, output_path, 2)
+    assert manifest.checkpoint("shard", input_path, output_path,
+                               resume=True).rows == 2
+    assert manifest.checkpoint("shard", input_path, output_path).rows == 0
+
+    # Output changed within the recorded rows.
+    output_path.write_text("0,0.0\n1,1.0\n")
+    assert manifest.checkpoint("shard", input_path, output_path,
+                               resume=True).rows == 0
+
+    # Output shorter than recorded.
+    output_path.write_text("")
+    label_rows(manifest.checkpoint("shard", input_path, output_path),
+               output_path, 2)
+    output_path.write_text("0,1.0\n")
+    assert manifest.checkpoint("shard", input_path, output_path,
+                               resume=True).rows == 0
+
+    # Input shard changed.
+    output_path.write_text("")
+    label_rows(manifest.checkpoint("shard", input_path, output_path),
+               output_path, 2)
+    write_shard(tmp_path, rows=6)
+    assert manifest.checkpoint("shard", input_path, output_path,
+                               resume=True).rows == 0
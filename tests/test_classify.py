@@ -0,0 +1,104 @@
+"""Test rule matching against matching each mention node on its own."""
+import random
+
+import pytest
+
+pytest.importorskip("negbio")
+nx = pytest.importorskip("networkx")
+
+from rule_graphs import PATTERNS_DIR, random_graphs  # noqa: E402
+from stages.classify import ModifiedDetector  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def detector():
+    detector = ModifiedDetector(PATTERNS_DIR / "pre_negation_uncertainty.txt",
+                                PATTERNS_DIR / "negation.txt",
+                                PATTERNS_DIR / "post_negation_uncertainty.txt")
+    # Tag every match with its rule and its rank among the rule's
+    # matches, so matches of both implementations can be compared.
+    detector.preneg_uncertain_patterns = tag_patterns(
+        detector.preneg_uncertain_patterns)
+    detector.neg_patterns = tag_patterns(detector.neg_patterns)
+    detector.uncertain_patterns = tag_patterns(detector.uncertain_patterns)
+    return detector
+
+
+class TaggedMatch(object):
+    def __init__(self, rule, rank, match):
+        self.rule = rule
+        self.rank = rank
+        self.match = match
+
+    def group(self, index):
+        return self.match.group(index)
+
+    def get(self, name):
+        return self.match.get(name)
+
+
+class TaggedPattern(object):
+    def __init__(self, rule, pattern):
+        self.rule = rule
+        self.pattern = pattern
+
+    def finditer(self, graph):
+        for rank, match in enumerate(self.pattern.finditer(graph)):
+            yield TaggedMatch(self.rule, rank, match)
+
+
+def tag_patterns(patterns):
+    return [TaggedPattern(rule, pattern)
+            for rule, pattern in enumerate(patterns)]
+
+
+def first_match(patterns, graph, node, is_excluded=None):
+    """Try the patterns for one node, as the Detector used to."""
+    for pattern in patterns:
+        for m in pattern.finditer(graph):
+            if m.group(0) == node and not (is_excluded and
+                                           is_excluded(graph, m)):
+                return m.rule, m.rank
+    return None
+
+
+def test_index_patterns_matches_per_node_matching(detector):
+    families = [
+        (detector.index_prenegation_uncertainty,
+         detector.preneg_uncertain_patterns, None),
+        (detector.index_neg, detector.neg_patterns,
+         detector.is_double_negation),
+        (detector.index_uncertainty, detector.uncertain_patterns, None),
+    ]
+    rng = random.Random(1)
+    n_matched = [0] * len(families)
+    for graph in random_graphs(300):
+        nodes = set(rng.sample(list(graph.nodes()),
+                               rng.randint(1, len(graph))))
+        for family, (index, patterns, is_excluded) in enumerate(families):
+            matches = index(graph, nodes)
+            assert set(matches) <= nodes
+            for node in nodes:
+                expected = first_match(patterns, graph, node, is_excluded)
+                m = matches.get(node)
+                assert (None if m is None else (m.rule, m.rank)) == expected
+                n_matched[family] += expected is not None
+    # Every family matches some of the nodes.
+    assert all(n_matched)
+
+
+def test_index_neg_passes_over_double_negation(detector):
+    # "effusion is not ruled out": the negation of "rule" is negated.
+    graph = nx.DiGraph()
+    graph.add_node("T0", lemma="effusion", tag="NN")
+    graph.add_node("T1", lemma="rule", tag="VBN")
+    graph.add_node("T2", lemma="not", tag="RB")
+    graph.add_edge("T1", "T0", dependency="nmod:out")
+    graph.add_edge("T1", "T2", dependency="neg")
+
+    expected = first_match(detector.neg_patterns, graph, "T0",
+                           detector.is_double_negation)
+    # The graph does hold a negation that is passed over.
+    assert first_match(detector.neg_patterns, graph, "T0") != expected
+    m = detector.index_neg(graph, {"T0"}).get("T0")
+    assert (None if m is None else (m.rule, m.rank)) == expected
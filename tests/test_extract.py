@@ -0,0 +1,127 @@
+"""Test mention extraction against the per-phrase regex scans it replaced."""
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("negbio")
+bioc = pytest.importorskip("bioc")
+
+from stages.extract import Extractor, PhraseMatcher  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return Extractor(ROOT / "phrases" / "mention",
+                     ROOT / "phrases" / "unmention")
+
+
+def finditer_matches(phrases, text):
+    """Match each phrase in turn, as the Extractor used to."""
+    return sorted((index,) + match.span(0)
+                  for index, phrase in enumerate(phrases)
+                  for match in re.finditer(phrase, text))
+
+
+def sentences(phrases, n_sentences=300, seed=0):
+    """Build sentences mixing phrases, repeats, overlaps and filler."""
+    rng = random.Random(seed)
+    filler = ["no", "the", "left", "right", "in the", "over the", "and",
+              "with", "is seen", "."]
+    texts = []
+    for _ in range(n_sentences):
+        words = []
+        for _ in range(rng.randint(1, 12)):
+            if rng.random() < 0.5:
+                phrase = rng.choice(phrases)
+                # Phrase prefixes and doubled phrases overlap other matches.
+                if rng.random() < 0.2:
+                    phrase = phrase[:rng.randint(1, len(phrase))]
+                if rng.random() < 0.1:
+                    phrase = phrase + phrase
+                words.append(phrase)
+            else:
+                words.append(rng.choice(filler))
+        # Words run together put phrases right next to each other.
+        texts.append("".join(word + rng.choice([" ", " ", ""])
+                             for word in words))
+    return texts
+
+
+def phrase_list(observation2phrases):
+    return [phrase for phrases in observation2phrases.values()
+            for phrase in phrases]
+
+
+def test_phrase_matcher_matches_finditer(extractor):
+    phrases = phrase_list(extractor.observation2mention_phrases) + \
+        phrase_list(extractor.observation2unmention_phrases)
+    matcher = PhraseMatcher(phrases)
+    for text in sentences(phrases):
+        assert matcher.findall(text) == finditer_matches(phrases, text)
+
+
+def test_phrase_matcher_handles_regex_phrases():
+    phrases = ["effusion", "pleural effusions?", "effusion|edema", "",
+               "aa", "a", "(?:left|right) lung"]
+    matcher = PhraseMatcher(phrases)
+    for text in ["pleural effusion and edema", "aaaaa", "left lung, right",
+                 "", "effusions"]:
+        assert matcher.findall(text) == finditer_matches(phrases, text)
+
+
+def overlaps_linear(extractor, text, observation, start, end):
+    """Scan every unmention of the observation, as the Extractor used to."""
+    for unmention in extractor.observation2unmention_phrases.get(
+            observation, []):
+        for match in re.finditer(unmention, text):
+            unmention_start, unmention_end = match.span(0)
+            if start < unmention_end and end > unmention_start:
+                return True
+    return False
+
+
+def test_unmention_overlap_matches_linear_scan(extractor):
+    phrases = phrase_list(extractor.observation2mention_phrases) + \
+        phrase_list(extractor.observation2unmention_phrases)
+    n_overlaps = 0
+    for text in sentences(phrases, seed=1):
+        sentence = bioc.BioCSentence()
+        sentence.offset = 0
+        sentence.text = text
+        unmention_spans = extractor.index_unmentions(sentence)
+        for index, start, end in extractor.mention_matcher.findall(text):
+            observation = extractor.mentions[index][0]
+            expected = overlaps_linear(extractor, text, observation,
+                                       start, end)
+            assert extractor.overlaps_with_unmention(
+                unmention_spans, observation, start, end) == expected
+            n_overlaps += expected
+    # The sentences exercise both outcomes.
+    assert n_overlaps > 0
+
+
+def test_unmention_overlap_with_nested_and_touching_spans(tmp_path):
+    mention_dir = tmp_path / "mention"
+    unmention_dir = tmp_path / "unmention"
+    mention_dir.mkdir()
+    unmention_dir.mkdir()
+    (mention_dir / "edema.txt").write_text("edema\nema\nma\nd\n")
+    # A long unmention holding a short one, and both next to mentions.
+    (unmention_dir / "edema.txt").write_text("xxedemaxx\nde\nxx\n")
+    extractor = Extractor(mention_dir, unmention_dir)
+
+    for text in ["xxedemaxx", "xxedemaxxedema", "edemaxx", "xxedema",
+                 "dede edema", "xedemaxx ema d", "xxma", "maxx"]:
+        sentence = bioc.BioCSentence()
+        sentence.offset = 0
+        sentence.text = text
+        unmention_spans = extractor.index_unmentions(sentence)
+        for index, start, end in extractor.mention_matcher.findall(text):
+            observation = extractor.mentions[index][0]
+            assert extractor.overlaps_with_unmention(
+                unmention_spans, observation, start, end) == \
+                overlaps_linear(extractor, text, observation, start, end)
@@ -0,0 +1,87 @@
+"""Test labeling documents one at a time."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("negbio")
+np = pytest.importorskip("numpy")
+
+import label  # noqa: E402
+from constants import CATEGORIES, CHECKPOINT_DIR  # noqa: E402
+from label import run_stages  # noqa: E402
+
+
+class RecordingStages(object):
+    """Stand-in for the stages, recording the calls made to them."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.verbose = False
+        self.calls = []
+
+    def extract_document(self, document):
+        self.calls.append(("extract", document.id))
+
+    def classify_document(self, document):
+        self.calls.append(("classify", document.id))
+
+    def finish(self):
+        self.calls.append(("finish",))
+
+    def aggregate_documents(self, documents, n_documents):
+        for document in documents:
+            # Documents still held by the collection.
+            held = sum(d is not None for d in self.collection.documents)
+            self.calls.append(("aggregate", document.id, held))
+        return n_documents
+
+
+def test_run_stages_releases_each_document():
+    n_documents = 5
+    collection = SimpleNamespace(documents=[SimpleNamespace(id=str(i))
+                                            for i in range(n_documents)])
+    stages = RecordingStages(collection)
+
+    assert run_stages(collection, stages, stages, stages) == n_documents
+    expected = []
+    for i in range(n_documents):
+        expected += [("extract", str(i)), ("classify", str(i)),
+                     ("aggregate", str(i), n_documents - i)]
+    assert stages.calls == expected + [("finish",)]
+    assert collection.documents == []
+
+
+def test_label_file_stops_writing_once_lock_is_lost(tmp_path, monkeypatch):
+    reports_path = tmp_path / "reports"
+    reports_path.mkdir()
+    (reports_path / "shard.csv").write_text(
+        "".join(f"{i:03d},report {i}\n" for i in range(6)))
+    out_path = tmp_path / "labeled"
+    out_path.mkdir()
+    lock_path = out_path / CHECKPOINT_DIR / "shard.csv.lock"
+    labeled = []
+
+    def label_collection(args, collection, *stages):
+        labeled.append(len(collection.documents))
+        if len(labeled) == 2:
+            # Another run takes over the shard while a chunk is labeled.
+            lock_path.write_text("another run\n")
+        return np.zeros((len(collection.documents), len(CATEGORIES)))
+
+    monkeypatch.setattr(label, "label_collection", label_collection)
+    args = SimpleNamespace(
+        reports_path=reports_path, output_path=out_path,
+        output_format="csv", omit_reports=False, chunk_size=2,
+        claim_shards=True, lock_timeout=60, resume=False,
+        extract_impression=False, extension="txt", verbose=False,
+        impression_rules="negbio", missing_impression="skip",
+        io_workers=1)
+
+    outcome = label.label_file(args, "shard.csv", out_path, "labeled_",
+                               None, None, None)
+    assert outcome == (label.CLAIMED, 2)
+    assert len(labeled) == 2
+    # Only the chunk labeled before the takeover was written.
+    rows = (out_path / "labeled_shard.csv").read_text().splitlines()
+    assert [row.split(",")[0] for row in rows] == ["Report ID", "000", "001"]
+    assert lock_path.read_text() == "another run\n"
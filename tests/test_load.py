@@ -0,0 +1,181 @@
+"""Test report loading against the straightforward steps it replaced."""
+import random
+import re
+import time
+
+import pytest
+
+pytest.importorskip("negbio")
+np = pytest.importorskip("numpy")
+
+from constants import CATEGORIES  # noqa: E402
+from etc import section_parser  # noqa: E402
+from loader import Loader  # noqa: E402
+from writer import CSVWriter  # noqa: E402
+
+# Reports, with or without an impression, and some identical once cleaned.
+IMPRESSION_REPORTS = ["FINDINGS: x\n IMPRESSION: No effusion.",
+                      "y\n IMPRESSION: no  effusion. \n",
+                      "x\n FINDINGS: Lungs clear.",
+                      "x\n IMPRESSION: \n",
+                      "lungs clear",
+                      "",
+                      "x\n \nNo effusion."]
+
+# Pieces of report text around which cleaning does something.
+PIECES = ["a", "B", "/", "and/or", "AND/OR", ".", "..", ". .", ",", " ",
+          "  ", "\n", "\t", "x/y", "1/2", "s/p", "é", " ", " ",
+          "lungs", "\x00"]
+
+
+@pytest.fixture
+def loader():
+    return Loader(None)
+
+
+def old_clean(loader, report):
+    """Clean a report, as Loader.clean used to."""
+    lower_report = report.lower()
+    corrected_report = re.sub('and/or', 'or', lower_report)
+    corrected_report = re.sub('(?<=[a-zA-Z])/(?=[a-zA-Z])', ' or ',
+                              corrected_report)
+    clean_report = corrected_report.replace("..", ".")
+    clean_report = clean_report.translate(loader.punctuation_spacer)
+    clean_report = ' '.join(clean_report.split())
+    clean_report = re.sub(r'\.\s+\.', '.', clean_report)
+    return clean_report
+
+
+def random_reports(n_reports, seed=0, separator=False):
+    rng = random.Random(seed)
+    pieces = PIECES if separator else PIECES[:-1]
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 12)))
+            for _ in range(n_reports)]
+
+
+def test_clean_matches_old_clean(loader):
+    for report in random_reports(20000):
+        assert loader.clean(report) == old_clean(loader, report)
+
+
+def test_clean_batch_matches_clean(loader):
+    reports = random_reports(5000, seed=1)
+    assert loader.clean_batch(reports) == [loader.clean(report)
+                                           for report in reports]
+    assert loader.clean_batch([]) == []
+
+
+def test_clean_batch_falls_back_on_separator(loader):
+    # Reports holding the separator are cleaned one at a time.
+    reports = random_reports(2000, seed=2, separator=True)
+    assert any("\x00" in report for report in reports)
+    assert loader.clean_batch(reports) == [loader.clean(report)
+                                           for report in reports]
+
+
+def expected_documents(loader, reports):
+    """Cleaned impression of each report, or None if it is skipped."""
+    impressions = [section_parser.extract_impression(report)
+                   for report in reports]
+    return [None if impression is None else loader.clean(impression)
+            for impression in impressions]
+
+
+def expanded_documents(loader):
+    """Text of the document expanded to each report, or None."""
+    documents = loader.collection.documents
+    labels = np.arange(len(documents), dtype=float)[:, np.newaxis]
+    return [None if np.isnan(row[0])
+            else documents[int(row[0])].passages[0].text
+            for row in loader.expand(labels)]
+
+
+def test_expand_and_skip_with_duplicates_and_skipped_reports():
+    rng = random.Random(3)
+    # Reports seen once leave documents no remaining report needs.
+    reports = [rng.choice(IMPRESSION_REPORTS) if rng.random() < 0.7
+               else f"x\n IMPRESSION: Seen once {i}." for i in range(60)]
+    loader = Loader(None, extract_impression=True, impression_rules="mimic")
+    loader.load_reports(reports)
+    loader.prep_collection()
+
+    expected = expected_documents(loader, reports)
+    texts = [document.passages[0].text
+             for document in loader.collection.documents]
+    # Duplicates, and skipped reports, share one document.
+    assert len(texts) == len(set(texts))
+    assert set(texts) == {text or "" for text in expected}
+    assert expanded_documents(loader) == expected
+
+    for n_reports in (0, 1, 7, 20):
+        loader.skip(n_reports)
+        reports = reports[n_reports:]
+        expected = expected[n_reports:]
+        assert loader.start == 60 - len(reports)
+        assert len(loader.collection.documents) == \
+            len(set(text or "" for text in expected))
+        assert expanded_documents(loader) == expected
+
+
+class SlowLoader(Loader):
+    """Loader reading some files slower, so reads finish out of order."""
+
+    def read_file(self, f):
+        time.sleep(0.01 * (int(f[1:5]) % 3))
+        return super().read_file(f)
+
+
+def write_reports(tmp_path, n_files):
+    reports = {}
+    for i in range(n_files):
+        name = f"s{i:04d}.txt"
+        reports[name] = f"\n IMPRESSION: report {i}." + " x" * (i % 5)
+        (tmp_path / name).write_text(reports[name])
+    # Other extensions are not listed.
+    (tmp_path / "notes.csv").write_text("not a report")
+    return reports
+
+
+@pytest.mark.parametrize("io_workers", [1, 3, 8])
+def test_iter_files_keeps_file_order(tmp_path, io_workers):
+    reports = write_reports(tmp_path, 50)
+    loader = SlowLoader(tmp_path, chunk_size=1, io_workers=io_workers)
+    files = loader.list_files()
+    assert files == sorted(reports)
+    assert list(loader.iter_files(files)) == [reports[f] for f in files]
+    # Reading a slice starts from its first file.
+    assert next(loader.iter_files(files[7:])) == reports[files[7]]
+
+
+@pytest.mark.parametrize("start", [0, 3, 8, 23])
+def test_iter_chunks_of_folder(tmp_path, start):
+    reports = write_reports(tmp_path, 23)
+    files = sorted(reports)
+    loader = SlowLoader(tmp_path, chunk_size=4, io_workers=3)
+    chunks = [(chunk.start, chunk.index, chunk.reports,
+               len(chunk.collection.documents))
+              for chunk in loader.iter_chunks(start=start)]
+    assert chunks == [(offset, files[offset:offset + 4],
+                       [reports[f] for f in files[offset:offset + 4]],
+                       len(files[offset:offset + 4]))
+                      for offset in range(start, len(files), 4)]
+
+
+@pytest.mark.parametrize("chunk_size", [None, 2])
+def test_string_ids_round_trip(tmp_path, chunk_size):
+    reports_path = tmp_path / "reports.csv"
+    ids = ["007", "0010", "", "12", "NA"]
+    reports_path.write_text("".join(f"{report_id},report {i}\n"
+                                    for i, report_id in enumerate(ids)))
+    loader = Loader(reports_path, chunk_size=chunk_size)
+    chunks = [loader] if chunk_size is None else loader.iter_chunks()
+
+    output_path = tmp_path / "labeled.csv"
+    writer = CSVWriter(output_path, include_reports=False)
+    for chunk in chunks:
+        labels = np.zeros((len(chunk.reports), len(CATEGORIES)))
+        writer.write(chunk.start, chunk.reports, labels, chunk.index)
+    writer.close()
+
+    rows = output_path.read_text().splitlines()[1:]
+    assert [row.split(",")[0] for row in rows] == ids
@@ -0,0 +1,133 @@
+"""Test claiming shards through lock files."""
+import os
+import threading
+import time
+
+import pytest
+
+from checkpoint import ShardLock, LockLostError
+
+
+def age(path, seconds):
+    """Make a lock file look last refreshed seconds ago."""
+    past = time.time() - seconds
+    os.utime(str(path), (past, past))
+
+
+def test_acquire_and_release(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    first = ShardLock(lock_path)
+    second = ShardLock(lock_path)
+
+    assert first.acquire()
+    assert lock_path.read_text().strip() == first.token
+    assert not second.acquire()
+    first.check()
+
+    first.release()
+    assert not lock_path.exists()
+    assert second.acquire()
+    second.release()
+    # Only the lock itself was ever left in the folder.
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    dead = ShardLock(lock_path)
+    assert dead.acquire()
+
+    # Without a timeout, or before it, a lock is never stale.
+    assert not ShardLock(lock_path).acquire()
+    assert not ShardLock(lock_path, stale_after=60).acquire()
+
+    age(lock_path, 120)
+    taker = ShardLock(lock_path, stale_after=60)
+    assert taker.acquire()
+    with pytest.raises(LockLostError):
+        dead.check()
+    dead.release()
+    assert taker.held()
+
+    taker.release()
+    assert not lock_path.exists()
+
+
+def test_stale_lock_taken_over_once(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    assert ShardLock(lock_path).acquire()
+    age(lock_path, 120)
+
+    early = ShardLock(lock_path, stale_after=60)
+    late = ShardLock(lock_path, stale_after=60)
+    judge_stale = late.is_stale
+
+    def overtaken():
+        # Another process takes over once this one judged the lock stale.
+        stale = judge_stale()
+        assert early.acquire()
+        return stale
+
+    late.is_stale = overtaken
+    assert not late.acquire()
+    assert early.held()
+    early.release()
+
+
+def test_remove_restores_another_lock(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    holder = ShardLock(lock_path)
+    assert holder.acquire()
+
+    # A process expecting an older token moves the lock aside, then puts
+    # it back.
+    assert not ShardLock(lock_path).remove("older token")
+    assert holder.held()
+    assert os.listdir(str(tmp_path)) == ["shard.lock"]
+    holder.release()
+
+
+def test_held_waits_for_a_lock_moved_aside(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    holder = ShardLock(lock_path)
+    assert holder.acquire()
+
+    moved_path = tmp_path / "shard.lock.moved"
+    os.rename(str(lock_path), str(moved_path))
+    restore = threading.Timer(0.02, os.rename,
+                              (str(moved_path), str(lock_path)))
+    restore.start()
+    assert holder.held()
+    restore.join()
+    holder.release()
+
+
+def test_heartbeat_keeps_lock_fresh(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    holder = ShardLock(lock_path, stale_after=0.4)
+    assert holder.acquire()
+
+    age(lock_path, 10)
+    time.sleep(0.3)
+    assert not holder.is_stale()
+    assert not ShardLock(lock_path, stale_after=0.4).acquire()
+
+    holder.release()
+    assert not holder.heartbeat.is_alive()
+    assert not lock_path.exists()
+
+
+def test_heartbeat_notices_lost_lock(tmp_path):
+    lock_path = tmp_path / "shard.lock"
+    holder = ShardLock(lock_path, stale_after=0.2)
+    assert holder.acquire()
+
+    lock_path.write_text("another process\n")
+    time.sleep(0.2)
+    assert holder.lost
+    with pytest.raises(LockLostError):
+        holder.check()
+
+    # The lock of the other process is left alone.
+    holder.release()
+    assert lock_path.read_text() == "another process\n"
@@ -0,0 +1,102 @@
+"""Test that the lemma prefilter only skips rules that cannot match."""
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("negbio")
+pytest.importorskip("networkx")
+
+from constants import NEGATION, UNCERTAINTY  # noqa: E402
+from rule_graphs import PATTERNS_DIR, random_graphs  # noqa: E402
+from stages import classify  # noqa: E402
+from stages.classify import ModifiedDetector, load_patterns  # noqa: E402
+from stages.prefilter import LemmaPrefilter, required_lemmas  # noqa: E402
+
+
+@pytest.mark.parametrize("pattern_text, lemmas", [
+    ("{} >{dependency:/neg/} {lemma:/no|not/}", ["no|not"]),
+    ("{} <{dependency:/nmod:of/} ({lemma:/rule/}=key >{} {lemma:/out/})",
+     ["rule", "out"]),
+    # A slash escaped inside a regex does not end it.
+    (r"{} >{} {lemma:/and\/or/}", [r"and\/or"]),
+    # Alternation, negation and optional relations need no lemma.
+    ("{lemma:/a/} | {lemma:/b/}", []),
+    ("{} !>{} {lemma:/a/}", []),
+    ("{} ?>{} {lemma:/a/}", []),
+    # Operators inside a regex are part of the regex.
+    ("{} >{dependency:/dobj|nsubj/} {lemma:/a?b/}", ["a?b"]),
+    ("{} >{dependency:/neg/} {}", []),
+])
+def test_required_lemmas(pattern_text, lemmas):
+    assert required_lemmas(pattern_text) == lemmas
+
+
+def test_prefilter_never_skips_a_matching_rule():
+    prefilter = LemmaPrefilter()
+    families = {}
+    for name in ("pre_negation_uncertainty", "negation",
+                 "post_negation_uncertainty"):
+        patterns, sources = load_patterns(PATTERNS_DIR / f"{name}.txt")
+        prefilter.add_rules(name, sources)
+        families[name] = patterns
+
+    n_skipped = 0
+    for graph in random_graphs(300, seed=2):
+        satisfied = prefilter.satisfied(graph)
+        # Lemmas indexed by earlier graphs give the same answer.
+        assert prefilter.satisfied(graph) == satisfied
+        for name, patterns in families.items():
+            candidates = prefilter.candidates(name, satisfied)
+            assert len(candidates) == len(patterns)
+            for pattern, candidate in zip(patterns, candidates):
+                if not candidate:
+                    n_skipped += 1
+                    assert next(iter(pattern.finditer(graph)), None) is None
+    # The graphs let the prefilter skip rules.
+    assert n_skipped > 0
+
+
+def test_detect_sentence_looks_up_lemmas_once(monkeypatch):
+    detector = ModifiedDetector(PATTERNS_DIR / "pre_negation_uncertainty.txt",
+                                PATTERNS_DIR / "negation.txt",
+                                PATTERNS_DIR / "post_negation_uncertainty.txt")
+    lookups = []
+    satisfied = detector.prefilter.satisfied
+
+    def count_satisfied(graph):
+        lookups.append(graph)
+        return satisfied(graph)
+
+    graphs = list(random_graphs(100, seed=4))
+    loaded = iter(graphs)
+    # Each sentence gets the next graph, with one mention per node.
+    monkeypatch.setattr(classify.semgraph, "load",
+                        lambda sentence: next(loaded), raising=False)
+    monkeypatch.setattr(classify.propagator, "propagate",
+                        lambda graph: None, raising=False)
+    monkeypatch.setattr(classify.neg_detector, "find_nodes",
+                        lambda graph, begin, end: [f"T{begin}"],
+                        raising=False)
+
+    for graph in graphs:
+        locs = [(int(node[1:]), int(node[1:]) + 1) for node in graph]
+        nodes = set(graph)
+        expected = {}
+        for name, index in (
+                (UNCERTAINTY, detector.index_prenegation_uncertainty),
+                (NEGATION, detector.index_neg),
+                (UNCERTAINTY, detector.index_uncertainty)):
+            matches = index(graph, nodes)
+            nodes -= matches.keys()
+            for node, m in matches.items():
+                expected[node] = (name, str(m.pattern))
+
+        sentence = SimpleNamespace(offset=0)
+        monkeypatch.setattr(detector.prefilter, "satisfied", count_satisfied)
+        decisions = {f"T{loc[0]}": (name, str(m.pattern))
+                     for name, m, loc
+                     in detector.detect_sentence(sentence, locs)}
+        monkeypatch.setattr(detector.prefilter, "satisfied", satisfied)
+        assert decisions == expected
+        assert lookups == [graph]
+        del lookups[:]
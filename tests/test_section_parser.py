@@ -0,0 +1,108 @@
+"""Test section_text against the slicing scan it replaced."""
+import random
+import re
+
+from etc import section_parser
+
+# Headers and text around which sectioning does something.
+PIECES = ["\n ", "\n \n", " ", "IMPRESSION:", "FINDINGS:", "IMPRESON:",
+          "CHEST, PA LATERAL:", "CLINICAL HISTORY:", "PA AND LAT:",
+          "WET READ:", "COMPARISON:", "NOTE:", "INDICATION: ", "\n",
+          "No effusion.", "lungs clear", ":", "A"]
+
+
+def old_normalize_section_names(section_names):
+    section_names = [s.lower().strip() for s in section_names]
+    for i, s in enumerate(section_names):
+        if s in section_parser.FREQUENT_SECTIONS:
+            section_names[i] = section_parser.FREQUENT_SECTIONS[s]
+            continue
+
+        main_flag = False
+        for m in section_parser.MAIN_SECTIONS:
+            if m in s:
+                section_names[i] = m
+                main_flag = True
+                break
+        if main_flag:
+            continue
+
+        m = section_parser.P_FINDINGS.search(s)
+        if m is not None:
+            section_names[i] = 'findings'
+    return section_names
+
+
+def old_section_text(text):
+    """Split text into sections, as section_text used to."""
+    p_section = re.compile(
+        r'\n ([A-Z ()/,-]+):\s', re.DOTALL)
+
+    sections = list()
+    section_names = list()
+    section_idx = list()
+
+    s = p_section.search(text, 0)
+
+    if s:
+        sections.append(text[0:s.start(1)])
+        section_names.append('preamble')
+        section_idx.append(0)
+
+        while s:
+            current_section = s.group(1).lower()
+            idx_start = s.end()
+            idx_skip = text[idx_start:].find('\n')
+            if idx_skip == -1:
+                idx_skip = 0
+
+            s = p_section.search(text, idx_start + idx_skip)
+
+            if s is None:
+                idx_end = len(text)
+            else:
+                idx_end = s.start()
+
+            sections.append(text[idx_start:idx_end])
+            section_names.append(current_section)
+            section_idx.append(idx_start)
+
+    else:
+        sections.append(text)
+        section_names.append('full report')
+        section_idx.append(0)
+
+    section_names = old_normalize_section_names(section_names)
+
+    for i in reversed(range(len(section_names))):
+        if section_names[i] in ('impression', 'findings'):
+            if sections[i].strip() == '':
+                sections.pop(i)
+                section_names.pop(i)
+                section_idx.pop(i)
+
+    if ('impression' not in section_names) & ('findings' not in section_names):
+        if '\n \n' in sections[-1]:
+            sections.append('\n \n'.join(sections[-1].split('\n \n')[1:]))
+            sections[-2] = sections[-2].split('\n \n')[0]
+            section_names.append('last_paragraph')
+            section_idx.append(section_idx[-1] + len(sections[-2]))
+
+    return sections, section_names, section_idx
+
+
+def random_reports(n_reports, seed=0):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(PIECES) for _ in range(rng.randint(0, 25)))
+            for _ in range(n_reports)]
+
+
+def test_section_text_matches_old_section_text():
+    for report in random_reports(20000):
+        assert section_parser.section_text(report) == old_section_text(report)
+
+
+def test_section_text_of_header_heavy_report():
+    report = "".join("\n FINDINGS: \n lungs clear" if i % 3 else
+                     "\n NOTE: \n \n" for i in range(300))
+    assert section_parser.section_text(report) == old_section_text(report)
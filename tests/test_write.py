@@ -0,0 +1,135 @@
+"""Test writing labeled reports."""
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from constants import *  # noqa: E402,F403
+from writer import CSVWriter, ParquetWriter, ArrowWriter  # noqa: E402
+
+REPORTS_TEXT = ["no effusion.", "cardiomegaly.", "", "possible edema."]
+
+
+def random_labels(n_reports, seed=0):
+    """Return labels with every value, unmentioned included."""
+    rng = np.random.RandomState(seed)
+    return rng.choice([np.nan, NEGATIVE, UNCERTAIN, POSITIVE],
+                      size=(n_reports, len(CATEGORIES)))
+
+
+def read_csv(path):
+    return pd.read_csv(path, dtype={REPORT_ID: str})
+
+
+def test_csv_keeps_string_ids(tmp_path):
+    output_path = tmp_path / "labeled.csv"
+    ids = ["007", "0010", "abc", "12"]
+    labels = random_labels(len(ids))
+    writer = CSVWriter(output_path)
+    writer.write(0, REPORTS_TEXT, labels, ids)
+    writer.close()
+
+    rows = output_path.read_text().splitlines()
+    assert [row.split(",")[0] for row in rows] == [REPORT_ID] + ids
+    written = read_csv(output_path)
+    assert list(written.columns) == [REPORT_ID, REPORTS] + CATEGORIES
+    assert written[REPORT_ID].tolist() == ids
+    np.testing.assert_array_equal(written[CATEGORIES].values, labels)
+
+
+@pytest.mark.parametrize("include_reports, ids, key", [
+    (True, ["1", "2"], REPORT_ID),
+    (False, ["1", "2"], REPORT_ID),
+    (True, None, REPORTS),
+    (False, None, REPORT_INDEX),
+])
+def test_csv_key(tmp_path, include_reports, ids, key):
+    output_path = tmp_path / "labeled.csv"
+    writer = CSVWriter(output_path, include_reports)
+    writer.write(5, REPORTS_TEXT[:2], random_labels(2), ids)
+
+    written = read_csv(output_path)
+    assert written.columns[0] == key
+    assert (REPORTS in written.columns) == include_reports
+    if key == REPORT_INDEX:
+        assert written[REPORT_INDEX].tolist() == [5, 6]
+
+
+def test_csv_appends_without_header(tmp_path):
+    output_path = tmp_path / "labeled.csv"
+    labels = random_labels(4, seed=1)
+    writer = CSVWriter(output_path, include_reports=False)
+    writer.write(0, REPORTS_TEXT[:2], labels[:2])
+    writer.write(2, REPORTS_TEXT[2:3], labels[2:3])
+    writer.close()
+    # A later run continues the output after its last row.
+    writer = CSVWriter(output_path, include_reports=False, append=True)
+    writer.write(3, REPORTS_TEXT[3:], labels[3:])
+    writer.close()
+
+    written = read_csv(output_path)
+    assert written[REPORT_INDEX].tolist() == [0, 1, 2, 3]
+    np.testing.assert_array_equal(written[CATEGORIES].values, labels)
+
+
+def read_columnar(writer_class, path):
+    """Return the table written and the number of its row groups."""
+    pa = pytest.importorskip("pyarrow")
+    if writer_class is ParquetWriter:
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(str(path))
+        return parquet_file.read(), parquet_file.num_row_groups
+    reader = pa.ipc.open_file(str(path))
+    return reader.read_all(), reader.num_record_batches
+
+
+@pytest.mark.parametrize("writer_class", [ParquetWriter, ArrowWriter])
+def test_columnar_codes_and_null_mask(tmp_path, writer_class):
+    pa = pytest.importorskip("pyarrow")
+    output_path = tmp_path / "labeled"
+    labels = random_labels(4, seed=2)
+    ids = ["007", "0010", "abc", "12"]
+    writer = writer_class(output_path)
+    writer.write(0, REPORTS_TEXT[:3], labels[:3], ids[:3])
+    writer.write(3, REPORTS_TEXT[3:], labels[3:], ids[3:])
+    writer.close()
+
+    table, n_groups = read_columnar(writer_class, output_path)
+    # One row group, or record batch, per write.
+    assert n_groups == 2
+    assert table.schema.names == [REPORT_ID, REPORTS] + CATEGORIES
+    assert table.schema.field(REPORT_ID).type == pa.string()
+    assert all(table.schema.field(category).type == pa.int8()
+               for category in CATEGORIES)
+    assert table.column(REPORT_ID).to_pylist() == ids
+    assert table.column(REPORTS).to_pylist() == REPORTS_TEXT
+    for index, category in enumerate(CATEGORIES):
+        expected = [None if np.isnan(label) else int(label)
+                    for label in labels[:, index]]
+        assert table.column(category).to_pylist() == expected
+
+
+@pytest.mark.parametrize("writer_class", [ParquetWriter, ArrowWriter])
+def test_columnar_keyed_by_row_without_ids(tmp_path, writer_class):
+    pa = pytest.importorskip("pyarrow")
+    output_path = tmp_path / "labeled"
+    writer = writer_class(output_path, include_reports=False)
+    writer.write(10, REPORTS_TEXT[:2], random_labels(2), None)
+    writer.write(12, REPORTS_TEXT[2:], random_labels(2, seed=1), None)
+    writer.close()
+
+    table, _ = read_columnar(writer_class, output_path)
+    assert table.schema.names == [REPORT_INDEX] + CATEGORIES
+    assert table.schema.field(REPORT_INDEX).type == pa.int64()
+    assert table.column(REPORT_INDEX).to_pylist() == [10, 11, 12, 13]
+
+
+@pytest.mark.parametrize("writer_class", [ParquetWriter, ArrowWriter])
+def test_columnar_without_reports_is_empty(tmp_path, writer_class):
+    pytest.importorskip("pyarrow")
+    output_path = tmp_path / "labeled"
+    writer_class(output_path).close()
+
+    table, _ = read_columnar(writer_class, output_path)
+    assert table.num_rows == 0
+    assert table.schema.names == [REPORT_INDEX, REPORTS] + CATEGORIES
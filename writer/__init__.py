@@ -0,0 +1,2 @@
+from .write import CSVWriter, ParquetWriter, ArrowWriter, open_writer
+from .write import CSV, PARQUET, ARROW, SUFFIXES
@@ -0,0 +1,157 @@
+"""Define label writer classes."""
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+# Output formats, and the file suffix of each.
+CSV = "csv"
+PARQUET = "parquet"
+ARROW = "arrow"
+SUFFIXES = {CSV: ".csv", PARQUET: ".parquet", ARROW: ".arrow"}
+
+
+def import_pyarrow():
+    """Import pyarrow, which is only needed for columnar outputs."""
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("pyarrow must be installed to write Parquet or "
+                          "Arrow outputs.")
+    return pyarrow
+
+
+class CSVWriter(object):
+    """Write labeled reports as CSV, with one label column per category.
+
+    Reports are keyed by their input ID when the input has one. Without
+    the report text, reports are otherwise keyed by their input row. With
+    append, rows are added to the end of an existing output written
+    without a header.
+    """
+
+    # Later runs can append to a partially written output.
+    appendable = True
+
+    def __init__(self, output_path, include_reports=True, append=False):
+        self.output_path = output_path
+        self.include_reports = include_reports
+        self.append = append
+
+    def write(self, start, reports, labels, ids=None):
+        """Write the labels of reports starting at input row start."""
+        # The label matrix backs the category columns without a copy.
+        labeled_reports = pd.DataFrame(labels, columns=CATEGORIES,
+                                       copy=False)
+        if self.include_reports:
+            labeled_reports.insert(0, REPORTS, reports)
+        if ids is not None:
+            labeled_reports.insert(0, REPORT_ID, ids)
+        elif not self.include_reports:
+            labeled_reports.insert(0, REPORT_INDEX,
+                                   np.arange(start, start + len(labels)))
+
+        labeled_reports.to_csv(self.output_path,
+                               index=False,
+                               mode='a' if self.append else 'w',
+                               header=not self.append)
+        self.append = True
+
+    def close(self):
+        pass
+
+
+class ColumnarWriter(object):
+    """Write labeled reports as a table keyed by the input ID of each
+    report, as a string, or its input row when the input has no IDs,
+    with one int8 column per category, null where it is not mentioned.
+
+    Every write adds one row group, or record batch, to the table.
+    """
+
+    appendable = False
+
+    def __init__(self, output_path, include_reports=True):
+        self.pa = import_pyarrow()
+        self.output_path = output_path
+        self.include_reports = include_reports
+        # The type of the IDs is known once the first reports are written.
+        self.schema = None
+        self.writer = None
+
+    def open_schema(self, ids):
+        """Start the output with the schema fitting the IDs."""
+        if ids is None:
+            key = self.pa.field(REPORT_INDEX, self.pa.int64())
+        else:
+            key = self.pa.field(REPORT_ID, self.pa.string())
+        fields = [key]
+        if self.include_reports:
+            fields.append(self.pa.field(REPORTS, self.pa.string()))
+        fields += [self.pa.field(category, self.pa.int8())
+                   for category in CATEGORIES]
+        self.schema = self.pa.schema(fields)
+        self.writer = self.open()
+
+    def table(self, start, reports, labels, ids=None):
+        """Convert labels into a table with the schema of the output."""
+        unmentioned = np.isnan(labels)
+        # Columns are contiguous in Fortran order.
+        codes = np.asfortranarray(np.where(unmentioned, 0, labels),
+                                  dtype=np.int8)
+        unmentioned = np.asfortranarray(unmentioned)
+
+        if ids is None:
+            ids = np.arange(start, start + len(labels))
+        else:
+            ids = [str(report_id) for report_id in ids]
+        columns = [self.pa.array(ids, type=self.schema.field(0).type)]
+        if self.include_reports:
+            columns.append(self.pa.array(reports, type=self.pa.string()))
+        columns += [self.pa.array(codes[:, index],
+                                  mask=unmentioned[:, index],
+                                  type=self.pa.int8())
+                    for index in range(len(CATEGORIES))]
+        return self.pa.Table.from_arrays(columns, schema=self.schema)
+
+    def write(self, start, reports, labels, ids=None):
+        """Write the labels of reports starting at input row start."""
+        if self.writer is None:
+            self.open_schema(ids)
+        self.writer.write_table(self.table(start, reports, labels, ids))
+
+    def close(self):
+        if self.writer is None:
+            self.open_schema(None)
+        self.writer.close()
+
+
+class ParquetWriter(ColumnarWriter):
+    """Write labeled reports as Parquet."""
+
+    def open(self):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(str(self.output_path), self.schema)
+
+
+class ArrowWriter(ColumnarWriter):
+    """Write labeled reports as an Arrow IPC file."""
+
+    def open(self):
+        return self.pa.ipc.new_file(str(self.output_path), self.schema)
+
+
+def open_writer(output_format, output_path, include_reports=True,
+                append=False):
+    """Open a writer for labels in the given format.
+
+    Only CSV outputs can be appended to; the others are always written
+    from their start.
+    """
+    if output_format == CSV:
+        return CSVWriter(output_path, include_reports, append)
+    if output_format == PARQUET:
+        return ParquetWriter(output_path, include_reports)
+    if output_format == ARROW:
+        return ArrowWriter(output_path, include_reports)
+    raise ValueError(f"Unknown output format {output_format}.")